@@ -91,6 +91,27 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Use a shared backend (e.g. Redis or Memcached) when running several workers,
+# the offer indexes of offers_app/indexes.py rely on it to see each other's changes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Seconds a cached offer list response is kept, see offers_app/cache.py
+OFFER_LIST_CACHE_TIMEOUT = 300
+
+# Seconds a rendered offer fragment is kept, see offers_app/fragments.py
+OFFER_FRAGMENT_CACHE_TIMEOUT = 3600
+
+# Seconds the batched order counts of a set of users are kept, see orders_app/stats.py
+ORDER_COUNTS_CACHE_TIMEOUT = 30
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -0,0 +1,49 @@
+"""
+ETag functions for conditional GET requests on offers.
+
+Each function computes the validator from a version or an updated_at
+aggregate with at most one query, so a matching `If-None-Match` is
+answered with 304 before anything is loaded or serialized. A function
+returns None when the object does not exist, so the view can answer 404.
+"""
+from django.db.models import Count, Max
+
+from user_auth_app.api.etags import make_etag
+
+from .. import cache as offer_cache
+from ..models import Offer, OfferDetail
+
+
+def offer_list_etag(request, *args, **kwargs):
+    """
+    The list depends on the normalized query and the cache version of its
+    scope, which every offer write bumps, see `offers_app.cache`.
+    """
+    return make_etag(offer_cache.get_cache_key(request))
+
+
+def offer_etag(request, pk=None, *args, **kwargs):
+    """
+    A single offer changes with its own `updated_at`, with the names of
+    its user and with the `updated_at` and number of its details.
+    """
+    if not str(pk).isdigit():
+        return None
+    versions = Offer.objects.filter(pk=pk).annotate(
+        details_updated_at=Max('details__updated_at'),
+        details_count=Count('details'),
+    ).values_list('updated_at', 'details_updated_at', 'details_count',
+                  'user__first_name', 'user__last_name', 'user__username').first()
+    if versions is None:
+        return None
+    return make_etag(request.get_host(), 'offer', int(pk), *versions)
+
+
+def offer_detail_etag(request, pk=None, *args, **kwargs):
+    if not str(pk).isdigit():
+        return None
+    updated_at = OfferDetail.objects.filter(
+        pk=pk).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None
+    return make_etag('detail', int(pk), updated_at)
@@ -0,0 +1,132 @@
+from django import forms
+from django.db.models import Exists, OuterRef
+from django_filters import rest_framework as django_filters
+from rest_framework import filters
+
+from offers_app import search
+from offers_app.indexes import feature_index
+from offers_app.models import OfferDetail, OfferListing
+
+INTEGER_ERROR = 'Muss eine ganze Zahl sein.'
+NUMBER_ERROR = 'Muss eine Zahl sein.'
+MAX_OFFER_IDS = 500
+
+
+class IntegerFilter(django_filters.NumberFilter):
+    field_class = forms.IntegerField
+
+
+class CharInFilter(django_filters.BaseInFilter, django_filters.CharFilter):
+    pass
+
+
+def get_feature_names(value):
+    return {feature_name.strip() for feature_name in value if feature_name.strip()}
+
+
+def get_feature_links(names):
+    """
+    Returns the feature links of offer details to the given features.
+    """
+    return OfferDetail.features.through.objects.filter(
+        feature__name__in=names, offerdetail__offer_id=OuterRef('offer_id'))
+
+
+def filter_offer_ids(queryset, offer_ids, fallback):
+    """
+    Keeps the listings of the given offers. Larger id sets than
+    MAX_OFFER_IDS would hit the parameter limit of the database, so
+    they are filtered with `fallback`, a join on the feature links.
+    """
+    if not offer_ids:
+        return queryset.none()
+    if len(offer_ids) > MAX_OFFER_IDS:
+        return fallback(queryset)
+    return queryset.filter(offer_id__in=sorted(offer_ids))
+
+
+class OfferFilter(django_filters.FilterSet):
+    """
+    Filters for the offer list. Every filter is answered from an index:
+
+    - creator_id, min_price__gte/lte, max_delivery_time and min_rating
+      use the composite indexes of OfferListing,
+    - offer_type uses the (offer_type, offer) index of OfferDetail,
+    - features and features_any use the in-process feature index, see
+      `offers_app.indexes`, and fall back to the feature links when
+      too many offers match.
+    """
+    creator_id = IntegerFilter(
+        field_name='user_id', error_messages={'invalid': INTEGER_ERROR})
+    max_delivery_time = IntegerFilter(
+        field_name='min_delivery_time', lookup_expr='lte',
+        error_messages={'invalid': INTEGER_ERROR})
+    min_price__gte = django_filters.NumberFilter(
+        field_name='min_price', lookup_expr='gte', error_messages={'invalid': NUMBER_ERROR})
+    min_price__lte = django_filters.NumberFilter(
+        field_name='min_price', lookup_expr='lte', error_messages={'invalid': NUMBER_ERROR})
+    offer_type = django_filters.ChoiceFilter(
+        choices=OfferDetail.OFFER_TYPES, method='filter_offer_type',
+        error_messages={'invalid_choice': 'Ungültiger Angebotstyp.'})
+    features = CharInFilter(method='filter_features')
+    features_any = CharInFilter(method='filter_features_any')
+    min_rating = django_filters.NumberFilter(
+        field_name='business_rating', lookup_expr='gte',
+        error_messages={'invalid': NUMBER_ERROR})
+
+    class Meta:
+        model = OfferListing
+        fields = []
+
+    def filter_offer_type(self, queryset, name, value):
+        """
+        Keeps offers having a detail of the given type.
+        """
+        return queryset.filter(Exists(OfferDetail.objects.filter(
+            offer_type=value, offer_id=OuterRef('offer_id'))))
+
+    def filter_features(self, queryset, name, value):
+        """
+        Keeps offers with a detail linked to every one of the comma
+        separated feature names. Unknown names match nothing.
+        """
+        names = get_feature_names(value)
+        if not names:
+            return queryset
+        return filter_offer_ids(
+            queryset, feature_index.offers_with_all(names),
+            lambda queryset: queryset.filter(
+                *[Exists(get_feature_links([feature_name])) for feature_name in names]))
+
+    def filter_features_any(self, queryset, name, value):
+        """
+        Keeps offers with a detail linked to at least one of the comma
+        separated feature names.
+        """
+        names = get_feature_names(value)
+        if not names:
+            return queryset
+        return filter_offer_ids(
+            queryset, feature_index.offers_with_any(names),
+            lambda queryset: queryset.filter(Exists(get_feature_links(names))))
+
+
+class OfferSearchFilter(filters.SearchFilter):
+    """
+    Search filter backed by the offer full-text index.
+
+    Matches every search word as a prefix of a word in the offer title,
+    description or feature names. Results are ranked by relevance unless
+    the client asks for an explicit `ordering`.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+
+        queryset = search.search_offers(queryset, ' '.join(search_terms))
+        if ('search_rank' in queryset.query.annotations
+                and filters.OrderingFilter.ordering_param not in request.query_params):
+            queryset = queryset.order_by('search_rank', 'pk')
+        return queryset
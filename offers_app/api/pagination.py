@@ -0,0 +1,143 @@
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination, CursorPagination, Cursor
+
+
+class OfferPagination(PageNumberPagination):
+    """Custom Pagination for Offers."""
+    page_size = 6
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+
+
+class OfferCursorPagination(CursorPagination):
+    """
+    Keyset pagination for offers.
+
+    The cursor stores the value of the ordering field together with the
+    primary key of the last row, so every page is a bounded range scan on
+    (ordering field, pk) instead of an OFFSET scan, and no COUNT(*) is run.
+    Offers without a value for the ordering field always come last.
+    """
+    page_size = 6
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    ordering = 'min_price'
+    ordering_fields = ('min_price', 'updated_at')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        reverse = bool(self.cursor and self.cursor.reverse)
+        position = None
+        if self.cursor and self.cursor.position is not None:
+            position = self.decode_position(self.cursor.position, queryset)
+
+        results = []
+        for segment in self.get_segments(queryset, position, reverse):
+            results.extend(segment[:self.page_size + 1 - len(results)])
+            if len(results) > self.page_size:
+                break
+        self.page = results[:self.page_size]
+        has_following_position = len(results) > len(self.page)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = position is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Returns the ordering term and the matching primary key tie-breaker,
+        e.g. ('-updated_at', '-pk').
+        """
+        ordering = super().get_ordering(request, queryset, view)[0]
+        if ordering.lstrip('-') not in self.ordering_fields:
+            ordering = self.ordering
+        tie_breaker = '-pk' if ordering.startswith('-') else 'pk'
+        return (ordering, tie_breaker)
+
+    def get_segments(self, queryset, position, reverse):
+        """
+        Returns the querysets of the rows following `position` in the
+        requested direction, in order: the rows with a value for the
+        ordering field and the rows without one, which come last in the
+        forward ordering. Each is a single range scan on the (field, pk)
+        index, bounded by the sargable predicate
+        field >= value AND (field > value OR pk > pk of the position).
+        """
+        field = self.ordering[0].lstrip('-')
+        descending = self.ordering[0].startswith('-') != reverse
+        lookup = 'lt' if descending else 'gt'
+        values = queryset.filter(**{f'{field}__isnull': False}).order_by(
+            *([f'-{field}', '-pk'] if descending else [field, 'pk']))
+        nulls = queryset.filter(**{f'{field}__isnull': True}).order_by(
+            '-pk' if descending else 'pk')
+
+        if position is None:
+            return [nulls, values] if reverse else [values, nulls]
+        value, pk = position
+        if value is None:
+            nulls = nulls.filter(**{f'pk__{lookup}': pk})
+            return [nulls, values] if reverse else [nulls]
+        values = values.filter(
+            Q(**{f'{field}__{lookup}e': value})
+            & (Q(**{f'{field}__{lookup}': value}) | Q(**{f'pk__{lookup}': pk})))
+        return [values] if reverse else [values, nulls]
+
+    def decode_position(self, position, queryset):
+        field = queryset.model._meta.get_field(self.ordering[0].lstrip('-'))
+        try:
+            value, pk = json.loads(position)
+            if value is not None:
+                value = field.to_python(value)
+            pk = int(pk)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        if self.page:
+            position = self._get_position_from_instance(
+                self.page[-1], self.ordering)
+        else:
+            position = self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+
+        if self.page:
+            position = self._get_position_from_instance(
+                self.page[0], self.ordering)
+        else:
+            position = self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def _get_position_from_instance(self, instance, ordering):
+        value = getattr(instance, ordering[0].lstrip('-'))
+        if isinstance(value, datetime.datetime):
+            # DjangoJSONEncoder drops the microseconds.
+            value = value.isoformat()
+        return json.dumps([value, instance.pk], cls=DjangoJSONEncoder)
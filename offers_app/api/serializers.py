@@ -1,11 +1,37 @@
+import ast
+
 from rest_framework import serializers, status
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import PermissionDenied, NotAuthenticated
-from ..models import Offer, OfferDetail, Feature
+from django.db import transaction
+from django.db.models import Min, prefetch_related_objects
+from django.utils import timezone
+from ..fragments import get_fragments, with_absolute_image
+from ..models import Offer, OfferDetail, Feature, OfferListing
+from ..signals import batch_offer_changes, offers_changed
 from decimal import Decimal
 
 OFFER_DETAIL_FIELDS = ['revisions',
                        'delivery_time_in_days', 'price', 'offer_type']
+OFFER_DETAIL_UPDATE_FIELDS = ['title'] + OFFER_DETAIL_FIELDS
+OFFER_FIELDS = ['title', 'image', 'description']
+
+
+def prefetch_features(details):
+    prefetch_related_objects(details, 'features')
+
+
+def parse_feature_name(name):
+    """
+    Older features were stored as the repr of a dict. Such names are
+    parsed as Python literals, any other name is returned unchanged.
+    """
+    if not name.startswith("{"):
+        return name
+    try:
+        return ast.literal_eval(name)
+    except (ValueError, SyntaxError):
+        return name
 
 
 class FeatureSerializer(serializers.ModelSerializer):
@@ -18,10 +44,20 @@ class FeatureSerializer(serializers.ModelSerializer):
 
     def to_internal_value(self, data):
         """
-        Overrides the default method to create a Feature if it doesn't exist.
+        Returns the cleaned feature name. The features themselves are
+        resolved in one batch when the offer or detail is saved.
         """
-        feature, created = Feature.objects.get_or_create(name=data)
-        return feature
+        if isinstance(data, dict):
+            data = data.get('name')
+        if not isinstance(data, str):
+            raise serializers.ValidationError(
+                'Ein Feature muss ein Text sein.')
+        name = data.strip()
+        max_length = Feature._meta.get_field('name').max_length
+        if len(name) > max_length:
+            raise serializers.ValidationError(
+                f'Ein Feature darf höchstens {max_length} Zeichen lang sein.')
+        return name
 
 
 class OfferDetailSerializer(serializers.ModelSerializer):
@@ -53,14 +89,11 @@ class OfferDetailSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         features_data = validated_data.pop('features', [])
-        offer_detail = OfferDetail.objects.create(**validated_data)
-
-        features = [
-            Feature.objects.get_or_create(
-                name=feature.get('name', '').strip())[0]
-            for feature in features_data if feature.get('name')
-        ]
-        offer_detail.features.set(features)
+        with transaction.atomic(), batch_offer_changes():
+            offer_detail = OfferDetail.objects.create(**validated_data)
+            offer_detail.features.set(
+                Feature.objects.resolve(features_data).values())
+            Offer.objects.filter(pk=offer_detail.offer_id).update_min_values()
         return offer_detail
 
     def update(self, instance, validated_data):
@@ -70,17 +103,20 @@ class OfferDetailSerializer(serializers.ModelSerializer):
                 detail='Nur der Eigentümer kann das Angebot aktualisieren.')
 
         features_data = validated_data.pop('features', [])
-        instance = super().update(instance, validated_data)
-
-        features = [
-            Feature.objects.get_or_create(
-                name=feature.get('name', '').strip())[0]
-            for feature in features_data if feature.get('name')
-        ]
-        instance.features.set(features)
+        with transaction.atomic(), batch_offer_changes():
+            instance = super().update(instance, validated_data)
+            instance.features.set(
+                Feature.objects.resolve(features_data).values())
+            Offer.objects.filter(pk=instance.offer_id).update_min_values()
         return instance
 
     def to_representation(self, instance):
+        return get_fragments('detail', [instance], self.render_fragment, prefetch_features)[0]
+
+    def render_fragment(self, instance):
+        """
+        Renders the detail for the fragment cache, see `offers_app.fragments`.
+        """
         representation = super().to_representation(instance)
 
         features_representation = [
@@ -95,7 +131,7 @@ class OfferSerializer(serializers.ModelSerializer):
     Serializer for the Offer model.
     """
     user = serializers.ReadOnlyField(source='user.id')
-    details = OfferDetailSerializer(many=True)
+    details = OfferDetailSerializer(many=True, write_only=True)
     user_details = serializers.SerializerMethodField('get_user_details_field')
 
     class Meta:
@@ -135,64 +171,87 @@ class OfferSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         user = self.validate_business_user()
+        with transaction.atomic():
+            return self.bulk_create_offers(user, [validated_data])[0]
 
-        details_data = validated_data.pop('details', [])
-        offer = Offer.objects.create(user=user, **validated_data)
-
-        min_price = None
-        min_delivery_time = None
-
-        for detail_data in details_data:
-            features_data = detail_data.pop('features')
-            offer_detail = OfferDetail.objects.create(
-                offer=offer, **detail_data)
-
-            features = [
-                Feature.objects.get_or_create(name=feature_name)[0]
-                for feature_name in features_data
+    @classmethod
+    def bulk_create_offers(cls, user, items):
+        """
+        Creates offers of `user` from validated data with one insert for
+        the offers, one for the details and one batched feature lookup and
+        insert for the feature links. Must run inside a transaction.
+        """
+        offers, details, details_data = [], [], []
+        for validated_data in items:
+            validated_data = dict(validated_data)
+            offer_details_data = validated_data.pop('details', [])
+            offer_details = [
+                OfferDetail(**{key: value for key, value in detail_data.items()
+                               if key != 'features'})
+                for detail_data in offer_details_data
+            ]
+            validated_data['min_price'] = min(
+                (detail.price for detail in offer_details), default=None)
+            validated_data['min_delivery_time'] = min(
+                (detail.delivery_time_in_days for detail in offer_details), default=None)
+
+            offers.append((Offer(user=user, **validated_data), offer_details))
+            details.extend(offer_details)
+            details_data.extend(offer_details_data)
+
+        Offer.objects.bulk_create([offer for offer, _ in offers])
+        for offer, offer_details in offers:
+            for detail in offer_details:
+                detail.offer = offer
+        OfferDetail.objects.bulk_create(details)
+        cls.create_feature_links(details, details_data)
+
+        details_data = iter(details_data)
+        for offer, offer_details in offers:
+            offer.created_details = [
+                (detail, [name for name in dict.fromkeys(next(details_data).get('features', []))
+                          if name])
+                for detail in offer_details
             ]
-            offer_detail.features.set(features)
 
-            if min_price is None or offer_detail.price < min_price:
-                min_price = offer_detail.price
-            if min_delivery_time is None or offer_detail.delivery_time_in_days < min_delivery_time:
-                min_delivery_time = offer_detail.delivery_time_in_days
+        # Bulk inserts send no signals.
+        offers_changed([offer.id for offer, _ in offers])
+        return [offer for offer, _ in offers]
 
-        offer.min_price = float(min_price)
-        offer.min_delivery_time = min_delivery_time
-        offer.save()
+    @staticmethod
+    def create_feature_links(details, details_data):
+        """
+        Resolves the feature names of all details in one batch and links
+        them with a single insert into the through table.
+        """
+        features = Feature.objects.resolve(
+            name for detail_data in details_data for name in detail_data.get('features', []))
 
-        return offer
+        Through = OfferDetail.features.through
+        Through.objects.bulk_create([
+            Through(offerdetail_id=detail.id, feature_id=features[name].id)
+            for detail, detail_data in zip(details, details_data)
+            for name in dict.fromkeys(detail_data.get('features', []))
+            if name
+        ])
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         request = self.context.get('request', None)
 
         if (request and request.method == 'POST'):
-            details = []
-            for detail in instance.details.all():
-                features = []
-                for feature in detail.features.all():
-                    if isinstance(feature.name, str):
-                        try:
-                            cleaned_name = eval(feature.name) if feature.name.startswith(
-                                "{") else feature.name
-                            features.append(cleaned_name)
-                        except Exception:
-                            features.append(feature.name)
-                    else:
-                        features.append(feature.name)
-
-                details.append({
+            representation['details'] = [
+                {
                     "id": detail.id,
                     "title": detail.title,
                     "revisions": detail.revisions,
                     "delivery_time_in_days": detail.delivery_time_in_days,
                     "price": detail.price,
-                    "features": features,
+                    "features": [parse_feature_name(name) for name in feature_names],
                     "offer_type": detail.offer_type,
-                })
-            representation['details'] = details
+                }
+                for detail, feature_names in self.get_created_details(instance)
+            ]
         else:
             representation['details'] = self.get_details_field(instance)
 
@@ -200,6 +259,21 @@ class OfferSerializer(serializers.ModelSerializer):
             instance.min_price)) if instance.min_price is not None else None
         return representation
 
+    @staticmethod
+    def get_created_details(instance):
+        """
+        Returns (detail, feature names) pairs of the offer. Offers built by
+        `bulk_create_offers` carry them in memory, other offers are loaded
+        with two queries.
+        """
+        created_details = getattr(instance, 'created_details', None)
+        if created_details is not None:
+            return created_details
+        return [
+            (detail, [feature.name for feature in detail.features.all()])
+            for detail in instance.details.prefetch_related('features')
+        ]
+
     def get_details_field(self, obj):
         """
         Retrieves a list of details associated with the given object.
@@ -220,6 +294,73 @@ class OfferSerializer(serializers.ModelSerializer):
         }
 
 
+class OfferListingSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the OfferListing read model.
+    Renders the same payload as OfferSerializer does for the offer list.
+    """
+    id = serializers.ReadOnlyField(source='offer_id')
+    user = serializers.ReadOnlyField(source='user_id')
+
+    class Meta:
+        model = OfferListing
+        fields = [
+            'id',
+            'user',
+            'title',
+            'image',
+            'description',
+            'created_at',
+            'updated_at',
+            'details',
+            'min_price',
+            'min_delivery_time',
+            'user_details'
+        ]
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        representation['min_price'] = Decimal("{0:.2f}".format(
+            instance.min_price)) if instance.min_price is not None else None
+        return representation
+
+
+class OfferFragmentSerializer(serializers.ModelSerializer):
+    """
+    Renders a single offer without its details, the cached part of the
+    SingleOfferSerializer payload.
+    """
+    user_details = serializers.SerializerMethodField('get_user_details_field')
+
+    class Meta:
+        model = Offer
+        fields = [
+            'id',
+            'user',
+            'title',
+            'image',
+            'description',
+            'created_at',
+            'updated_at',
+            'min_price',
+            'min_delivery_time',
+            'user_details'
+        ]
+
+    def get_user_details_field(self, obj):
+        return {
+            "first_name": obj.user.first_name,
+            "last_name": obj.user.last_name,
+            "username": obj.user.username,
+        }
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        representation['min_price'] = Decimal("{0:.2f}".format(
+            instance.min_price)) if instance.min_price is not None else None
+        return representation
+
+
 class SingleOfferSerializer(serializers.ModelSerializer):
     """
     Serializer for a single Offer model.
@@ -272,27 +413,18 @@ class SingleOfferSerializer(serializers.ModelSerializer):
         }
 
     def to_representation(self, instance):
-        representation = super().to_representation(instance)
-
-        details_representation = []
-        for detail in instance.details.all():
-            features_representation = [
-                feature.name for feature in detail.features.all()]
-            details_representation.append({
-                "id": detail.id,
-                "title": detail.title,
-                "revisions": detail.revisions,
-                "delivery_time_in_days": detail.delivery_time_in_days,
-                "price": detail.price,
-                "features": features_representation,
-                "offer_type": detail.offer_type,
-            })
-
-        representation['details'] = details_representation
-
-        representation['min_price'] = Decimal("{0:.2f}".format(
-            instance.min_price)) if instance.min_price is not None else None
-        return representation
+        """
+        Assembles the offer from the cached fragments of the offer and of
+        its details, see `offers_app.fragments`.
+        """
+        offer = with_absolute_image(get_fragments(
+            'offer', [instance], OfferFragmentSerializer().to_representation)[0],
+            self.context.get('request'))
+        details = get_fragments(
+            'detail', list(instance.details.all()),
+            OfferDetailSerializer().render_fragment, prefetch_features)
+        return {field: details if field == 'details' else offer[field]
+                for field in self.Meta.fields}
 
     def update(self, instance, validated_data):
         user = self.get_current_user_from_request(self.context)
@@ -302,89 +434,146 @@ class SingleOfferSerializer(serializers.ModelSerializer):
                 detail='Nur der Eigentümer oder das Personal kann das Angebot aktualisieren.')
 
         details_data = validated_data.pop('details', [])
-        self.update_offer_fields(instance, validated_data)
-        self.update_offer_details(instance, details_data)
-        self.update_min_values(instance)
+        with transaction.atomic(), batch_offer_changes():
+            changed_fields = self.apply_changes(
+                instance, validated_data, OFFER_FIELDS)
+            details_changed = self.update_offer_details(instance, details_data)
+            if details_changed:
+                changed_fields += self.update_min_values(instance)
+            if changed_fields or details_changed:
+                instance.save(update_fields=changed_fields + ['updated_at'])
 
         return instance
 
-    def update_min_values(self, instance):
+    @staticmethod
+    def apply_changes(obj, data, fields):
         """
-        Berechnet und aktualisiert `min_price` und `min_delivery_time` basierend
-        auf den zugehörigen OfferDetails.
+        Sets the given fields of `obj` from `data` and returns the names of
+        the fields whose value actually changed.
         """
-        details = instance.details.all()
+        changed = []
+        for field in fields:
+            if field in data and getattr(obj, field) != data[field]:
+                setattr(obj, field, data[field])
+                changed.append(field)
+        return changed
 
-        if details.exists():
-            instance.min_price = min(detail.price for detail in details)
-            instance.min_delivery_time = min(
-                detail.delivery_time_in_days for detail in details)
-        else:
-            instance.min_price = None
-            instance.min_delivery_time = None
-
-        instance.save()
-
-    def update_offer_fields(self, instance, validated_data):
-        OFFER_FIELDS = ['title', 'image', 'description', 'updated_at',
-                        'min_price', 'min_delivery_time']
-        for field in OFFER_FIELDS:
-            setattr(instance, field, validated_data.get(
-                field, getattr(instance, field)))
-        instance.save()
+    def update_min_values(self, instance):
+        """
+        Berechnet `min_price` und `min_delivery_time` mit einer Aggregation
+        über die zugehörigen OfferDetails und gibt die geänderten Felder zurück.
+        """
+        min_values = instance.details.aggregate(
+            min_price=Min('price'), min_delivery_time=Min('delivery_time_in_days'))
+        return self.apply_changes(instance, min_values, ['min_price', 'min_delivery_time'])
 
     def update_offer_details(self, instance, details_data):
         """
-        Updates or creates offer details for the given offer instance.
-        Removes any existing offer details not included in the request data.
+        Applies the given details to the offer as a diff and returns whether
+        anything changed. Details are matched by `id` or, failing that, by
+        `offer_type`. Changed details are written with one bulk_update, new
+        ones with one bulk_create, and existing details not included in the
+        request data are removed. Features are synced by set difference.
         """
         if not details_data:
-            return
+            return False
 
-        existing_details = {
-            detail.id: detail for detail in instance.details.all()}
+        unmatched = {detail.id: detail for detail in instance.details.all()}
+        raw_details = self.initial_data.get('details') or []
 
-        for detail_data in details_data:
-            detail_id = detail_data.get('id')
-            if detail_id and detail_id in existing_details:
-                detail = existing_details.pop(detail_id)
-                self.update_offer_detail_fields(detail, detail_data)
-            else:
-                self.create_offer_detail(instance, detail_data)
+        changed_details, changed_fields, new_details = [], set(), []
+        now = timezone.now()
+        features_by_detail = []
+        for index, detail_data in enumerate(details_data):
+            detail = self.match_offer_detail(
+                unmatched, detail_data, raw_details[index] if index < len(raw_details) else None)
 
-        for detail in existing_details.values():
-            detail.delete()
+            if detail is None:
+                detail = self.build_offer_detail(instance, detail_data)
+                new_details.append(detail)
+            else:
+                fields = self.apply_changes(
+                    detail, detail_data, OFFER_DETAIL_UPDATE_FIELDS)
+                if fields:
+                    detail.updated_at = now
+                    changed_details.append(detail)
+                    changed_fields.update(fields)
+
+            if detail_data.get('features'):
+                features_by_detail.append((detail, detail_data['features']))
+
+        if unmatched:
+            OfferDetail.objects.filter(id__in=unmatched).delete()
+        if changed_details:
+            OfferDetail.objects.bulk_update(
+                changed_details, sorted(changed_fields) + ['updated_at'])
+        if new_details:
+            OfferDetail.objects.bulk_create(new_details)
+        features_changed = self.sync_features(features_by_detail)
+
+        return bool(unmatched or changed_details or new_details or features_changed)
 
-    def create_offer_detail(self, instance, detail_data):
+    @staticmethod
+    def match_offer_detail(unmatched, detail_data, raw_detail):
         """
-        Creates a new OfferDetail instance and associates it with the given offer.
+        Pops the existing detail the request data refers to from `unmatched`,
+        by the `id` sent by the client or else by `offer_type`.
         """
-        features_data = detail_data.pop('features', [])
-        new_detail = OfferDetail.objects.create(offer=instance, **detail_data)
-
-        if features_data:
-            features = self.get_or_create_features(features_data)
-            new_detail.features.set(features)
-
-        new_detail.save()
-
-    def update_offer_detail_fields(self, offer_detail, detail_data):
+        if isinstance(raw_detail, dict) and raw_detail.get('id') in unmatched:
+            return unmatched.pop(raw_detail['id'])
+        for detail_id, detail in unmatched.items():
+            if detail.offer_type == detail_data.get('offer_type'):
+                return unmatched.pop(detail_id)
+        return None
+
+    def build_offer_detail(self, instance, detail_data):
         """
-        Updates fields and features for an existing OfferDetail instance.
+        Builds an unsaved OfferDetail for the given offer, checking that all
+        required fields are present.
         """
-        for field in ['title', 'revisions', 'delivery_time_in_days', 'price', 'offer_type']:
-            setattr(offer_detail, field, detail_data.get(
-                field, getattr(offer_detail, field)))
+        missing = [field for field in OFFER_DETAIL_UPDATE_FIELDS
+                   if field not in detail_data and field != 'offer_type']
+        if missing:
+            raise serializers.ValidationError(
+                {'details': f'Neue Angebotsdetails benötigen: {", ".join(missing)}.'})
+        return OfferDetail(offer=instance, **{
+            field: detail_data[field] for field in OFFER_DETAIL_UPDATE_FIELDS if field in detail_data})
 
-        features_data = detail_data.get('features', [])
-        if features_data:
-            features = self.get_or_create_features(features_data)
-            offer_detail.features.set(features)
+    def sync_features(self, features_by_detail):
+        """
+        Makes the features of each detail equal to the given names with one
+        batched feature lookup, one insert and one delete on the through
+        table, and moves `updated_at` of the changed details forward.
+        Returns whether any link changed.
+        """
+        if not features_by_detail:
+            return False
+
+        features = Feature.objects.resolve(
+            name for _, names in features_by_detail for name in names)
+        wanted = {
+            (detail.id, features[name].id)
+            for detail, names in features_by_detail for name in names if name
+        }
 
-        offer_detail.save()
+        Through = OfferDetail.features.through
+        current = {
+            (offerdetail_id, feature_id): pk
+            for pk, offerdetail_id, feature_id in Through.objects.filter(
+                offerdetail_id__in={detail.id for detail, _ in features_by_detail}
+            ).values_list('id', 'offerdetail_id', 'feature_id')
+        }
 
-    def get_or_create_features(self, features_data):
-        return [
-            Feature.objects.get_or_create(name=feature_name)[0]
-            for feature_name in features_data
-        ]
+        to_add = wanted - current.keys()
+        to_remove = {link: pk for link, pk in current.items() if link not in wanted}
+        if to_add:
+            Through.objects.bulk_create([
+                Through(offerdetail_id=offerdetail_id, feature_id=feature_id)
+                for offerdetail_id, feature_id in sorted(to_add)
+            ])
+        if to_remove:
+            Through.objects.filter(id__in=to_remove.values()).delete()
+        changed = {offerdetail_id for offerdetail_id, _ in to_add | to_remove.keys()}
+        if changed:
+            OfferDetail.objects.filter(id__in=changed).update(updated_at=timezone.now())
+        return bool(changed)
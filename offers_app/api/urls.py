@@ -1,12 +1,21 @@
 from django.urls import path
 
-from offers_app.api.views import OfferView, SingleOfferView, SingleOfferDetailsView
+from offers_app.api.views import (OfferView, OfferFacetsView, OfferImportView, OfferSuggestView,
+                                  SingleOfferView, SimilarOffersView, SingleOfferDetailsView)
 
 urlpatterns = [
     # URL pattern for the list of offers
     path('api/offers/', OfferView.as_view(), name='offers'),
+    # URL pattern for the facet counts of the list of offers
+    path('api/offers/facets/', OfferFacetsView.as_view(), name='offer_facets'),
+    # URL pattern for the NDJSON bulk import of offers
+    path('api/offers/import/', OfferImportView.as_view(), name='offer_import'),
+    # URL pattern for the search box completions
+    path('api/offers/suggest/', OfferSuggestView.as_view(), name='offer_suggest'),
     # URL pattern for a single offer
     path('api/offers/<pk>/', SingleOfferView.as_view(), name='single_offer'),
+    # URL pattern for the offers similar to a single offer
+    path('api/offers/<int:pk>/similar/', SimilarOffersView.as_view(), name='similar_offers'),
     # URL pattern for the details of a single offer
     path('api/offerdetails/<pk>/', SingleOfferDetailsView.as_view(),
          name='single_offer_details')
@@ -1,70 +1,237 @@
 from rest_framework import generics, permissions, status
 from rest_framework.exceptions import PermissionDenied, NotFound, ValidationError
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
 
-from django.db.models import Q
-
-from .serializers import OfferSerializer, SingleOfferSerializer, OfferDetailSerializer
-from ..models import Offer, OfferDetail
+import json
 
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 
-class OfferPagination(PageNumberPagination):
-    """Custom Pagination for Offers."""
-    page_size = 6
-    page_size_query_param = 'page_size'
-    max_page_size = 50
+from .etags import offer_list_etag, offer_etag, offer_detail_etag
+from .filters import OfferFilter, OfferSearchFilter
+from .. import cache as offer_cache, facets, indexes
+from ..fragments import get_fragments, with_absolute_image
+from .pagination import OfferPagination, OfferCursorPagination
+from .serializers import OfferSerializer, OfferListingSerializer, SingleOfferSerializer, OfferDetailSerializer
+from ..models import Offer, OfferDetail, OfferListing, SimilarOffer
 
 
+@method_decorator(condition(etag_func=offer_list_etag), name='get')
 class OfferView(generics.ListCreateAPIView):
     """
     API view to list and create offers.
 
     Query Parameters:
     - creator_id: Filter by the creator's user ID
-    - search: Search in offer title or description
+    - search: Full-text search in offer title, description and feature names
     - max_delivery_time: Filter offers with delivery time <= max_delivery_time
+    - min_price__gte, min_price__lte: Filter by the minimum price of the offer
+    - offer_type: Filter offers having a detail of the given type
+    - features: Comma separated feature names the offer must all include
+    - features_any: Comma separated feature names the offer must include one of
+    - min_rating: Filter by the minimum average review rating of the creator
+    - pagination: Set to 'cursor' to use keyset pagination instead of page numbers
     """
     permission_classes = [permissions.IsAuthenticated]
 
-    queryset = Offer.objects.all()
+    queryset = OfferListing.objects.all()
     serializer_class = OfferSerializer
     pagination_class = OfferPagination
     filter_backends = [DjangoFilterBackend,
-                       filters.OrderingFilter, filters.SearchFilter]
+                       filters.OrderingFilter, OfferSearchFilter]
+    filterset_class = OfferFilter
 
-    search_fields = ['title', 'description']
     ordering_fields = ['min_price', 'updated_at']
     ordering = ['min_price']
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
+    @property
+    def paginator(self):
+        """
+        Uses keyset pagination when the client opts in with `pagination=cursor`
+        or follows a cursor link, page-number pagination otherwise.
+        """
+        if not hasattr(self, '_paginator'):
+            query_params = self.request.query_params
+            if (query_params.get('pagination') == 'cursor'
+                    or OfferCursorPagination.cursor_query_param in query_params):
+                self._paginator = OfferCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
-        creator_id = self.request.query_params.get('creator_id')
-        max_delivery_time = self.request.query_params.get('max_delivery_time')
+    def get_serializer_class(self):
+        """
+        Lists are rendered from the OfferListing read model, creation uses OfferSerializer.
+        """
+        if self.request.method == 'GET':
+            return OfferListingSerializer
+        return super().get_serializer_class()
 
-        if creator_id:
-            try:
-                creator_id = int(creator_id)
-                queryset = queryset.filter(user_id=creator_id)
-            except ValueError:
-                raise ValidationError(
-                    {'creator_id': 'Muss eine ganze Zahl sein.'})
+    def list(self, request, *args, **kwargs):
+        """
+        Serves repeated list queries from the cache, see `offers_app.cache`.
+        """
+        cache_key = offer_cache.get_cache_key(request)
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response(data)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            response = self.get_paginated_response(self.render_listings(page))
+        else:
+            response = Response(self.render_listings(queryset))
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(cache_key, response.data, offer_cache.get_timeout())
+        return response
+
+    def render_listings(self, listings):
+        """
+        Renders the listings from their cached fragments, see `offers_app.fragments`.
+        """
+        fragments = get_fragments(
+            'listing', list(listings), OfferListingSerializer().to_representation)
+        return [with_absolute_image(fragment, self.request) for fragment in fragments]
+
+
+@method_decorator(condition(etag_func=offer_list_etag), name='get')
+class OfferFacetsView(generics.GenericAPIView):
+    """
+    API view returning facet counts for the offer list.
+
+    Accepts the same filter and `search` query parameters as OfferView
+    and returns the number of matching offers per delivery time bucket,
+    price band, offer type and top feature.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    queryset = OfferListing.objects.all()
+    filter_backends = [DjangoFilterBackend, OfferSearchFilter]
+    filterset_class = OfferFilter
+
+    def get(self, request, *args, **kwargs):
+        cache_key = offer_cache.get_cache_key(
+            request, prefix=offer_cache.FACETS_CACHE_KEY)
+        data = cache.get(cache_key)
+        if data is None:
+            data = facets.get_facets(self.filter_queryset(self.get_queryset()))
+            cache.set(cache_key, data, offer_cache.get_timeout())
+        return Response(data)
+
+
+class OfferImportView(generics.GenericAPIView):
+    """
+    API view to import many offers of the requesting business user at once.
+
+    The request body is NDJSON: one offer in the format accepted by
+    OfferView per line. Lines are read and validated one at a time and
+    written in batches of `batch_size`, each batch in its own transaction.
+    The response streams one NDJSON result per line as soon as its batch
+    is written: `{"line": 1, "status": "created", "id": 7}` or
+    `{"line": 2, "status": "error", "errors": {...}}`.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = OfferSerializer
+    batch_size = 100
 
-        if max_delivery_time:
+    def post(self, request, *args, **kwargs):
+        if request.user.userprofile.type != 'business':
+            raise PermissionDenied(
+                {'detail': 'Nur Geschäftskunden können Angebote importieren.'})
+        return StreamingHttpResponse(
+            self.import_offers(request), content_type='application/x-ndjson')
+
+    def read_lines(self, request):
+        """
+        Yields (line number, validated data or None, errors) for every
+        non-empty line of the body.
+        """
+        stream = request.stream
+        if stream is None:
+            return
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
             try:
-                max_delivery_time = int(max_delivery_time)
-                queryset = queryset.filter(
-                    min_delivery_time__lte=max_delivery_time)
+                data = json.loads(line)
             except ValueError:
-                raise ValidationError(
-                    {'max_delivery_time': 'Muss eine ganze Zahl sein.'})
+                yield number, None, {'detail': 'Ungültiges JSON.'}
+                continue
+            if not isinstance(data, dict):
+                yield number, None, {'detail': 'Jede Zeile muss ein Angebot sein.'}
+                continue
 
-        return queryset
+            serializer = self.get_serializer(data=data)
+            if serializer.is_valid():
+                yield number, serializer.validated_data, None
+            else:
+                yield number, None, serializer.errors
+
+    def import_offers(self, request):
+        batch = []
+        for number, validated_data, errors in self.read_lines(request):
+            if errors is not None:
+                yield self.render_result(number, 'error', errors=errors)
+                continue
+            batch.append((number, validated_data))
+            if len(batch) >= self.batch_size:
+                yield from self.write_batch(request.user, batch)
+                batch = []
+        if batch:
+            yield from self.write_batch(request.user, batch)
+
+    def write_batch(self, user, batch):
+        try:
+            with transaction.atomic():
+                offers = OfferSerializer.bulk_create_offers(
+                    user, [validated_data for _, validated_data in batch])
+        except DatabaseError:
+            for number, _ in batch:
+                yield self.render_result(number, 'error', errors={
+                    'detail': 'Das Angebot konnte nicht gespeichert werden.'})
+            return
+        for (number, _), offer in zip(batch, offers):
+            yield self.render_result(number, 'created', id=offer.id)
+
+    @staticmethod
+    def render_result(number, result_status, **result):
+        return json.dumps({'line': number, 'status': result_status, **result}) + '\n'
 
 
+class OfferSuggestView(generics.GenericAPIView):
+    """
+    API view returning completions for the offer search box.
+
+    Query Parameters:
+    - q: The typed prefix, matched against offer titles and feature names ignoring case
+    - limit: The maximum number of titles and of feature names, 5 by default
+
+    Completions are served from the in-process indexes of `offers_app.indexes`
+    without querying the catalog.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    max_limit = 20
+
+    def get(self, request, *args, **kwargs):
+        prefix = request.query_params.get('q', '').strip()
+        try:
+            limit = int(request.query_params.get('limit', indexes.SUGGEST_LIMIT))
+        except ValueError:
+            raise ValidationError({'limit': ['Muss eine ganze Zahl sein.']})
+        limit = min(max(limit, 1), self.max_limit)
+        if not prefix:
+            return Response({'titles': [], 'features': []})
+        return Response(indexes.suggest(prefix, limit))
+
+
+@method_decorator(condition(etag_func=offer_etag), name='get')
 class SingleOfferView(generics.RetrieveUpdateDestroyAPIView):
     """
     API view to retrieve, update and delete a single offer.
@@ -73,6 +240,18 @@ class SingleOfferView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Offer.objects.all()
     serializer_class = SingleOfferSerializer
 
+    def get_queryset(self):
+        """
+        Eager-load the user and details for reads. Features are only loaded
+        for details missing from the fragment cache.
+        Writes use the plain queryset so no stale prefetch cache is reused.
+        """
+        queryset = super().get_queryset()
+        if self.request.method == 'GET':
+            queryset = queryset.select_related(
+                'user').prefetch_related('details')
+        return queryset
+
     def perform_destroy(self, instance):
         """
         Custom deletion logic.
@@ -96,6 +275,34 @@ class SingleOfferView(generics.RetrieveUpdateDestroyAPIView):
             )
 
 
+class SimilarOffersView(generics.GenericAPIView):
+    """
+    API view listing the offers most similar to a single offer, best first.
+
+    Every result is rendered like an entry of the offer list and carries its
+    `score`. The neighbors are read from the SimilarOffer table, see
+    `offers_app.similarity`.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk, *args, **kwargs):
+        neighbors = list(SimilarOffer.objects.filter(offer_id=pk).order_by(
+            '-score', 'similar_id').values_list('similar_id', 'score'))
+        if not neighbors and not Offer.objects.filter(pk=pk).exists():
+            raise NotFound({"detail": "Angebot nicht gefunden."})
+
+        listings = OfferListing.objects.in_bulk([similar_id for similar_id, _ in neighbors])
+        neighbors = [(listings[similar_id], score) for similar_id, score in neighbors
+                     if similar_id in listings]
+        fragments = get_fragments('listing', [listing for listing, _ in neighbors],
+                                  OfferListingSerializer().to_representation)
+        return Response([
+            {**with_absolute_image(fragment, request), 'score': score}
+            for fragment, (_, score) in zip(fragments, neighbors)
+        ])
+
+
+@method_decorator(condition(etag_func=offer_detail_etag), name='get')
 class SingleOfferDetailsView(generics.RetrieveUpdateAPIView):
     """
     API view to retrieve details of a single offer.
@@ -0,0 +1,102 @@
+"""
+Response cache for offer list and facet queries.
+
+Cached responses are keyed on the normalized query parameters and on a
+version tag. Queries filtered by `creator_id` use the version of that
+creator, every other query uses the global catalog version. Writing an
+offer bumps the version of its creator and the catalog version, so stale
+entries are never read again and simply expire.
+
+Versions are bumped right away and once more when the transaction
+commits, so a response computed from data that was not yet committed
+is never served under the new version.
+"""
+import hashlib
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+CATALOG_VERSION_KEY = 'offers:version:catalog'
+CREATOR_VERSION_KEY = 'offers:version:creator:{}'
+LIST_CACHE_KEY = 'offers:list:{tag}:{version}:{digest}'
+FACETS_CACHE_KEY = 'offers:facets:{tag}:{version}:{digest}'
+
+
+def _initial_version():
+    return time.time_ns()
+
+
+def get_version(key):
+    """
+    Returns the current version stored under `key`, creating it if needed.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    """
+    Bumps the version stored under `key` and returns the new version.
+    """
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), timeout=None)
+        return cache.get(key)
+
+
+def _bump_versions(keys):
+    for key in keys:
+        bump_version(key)
+
+
+def invalidate_offers(user_ids):
+    """
+    Invalidates cached offer lists of the given creators and of the whole catalog.
+    """
+    keys = [CATALOG_VERSION_KEY] + [CREATOR_VERSION_KEY.format(user_id)
+                                    for user_id in sorted(set(user_ids))]
+    _bump_versions(keys)
+    transaction.on_commit(partial(_bump_versions, keys))
+
+
+def get_scope(request):
+    """
+    Returns the (tag, version key) pair a query depends on.
+    """
+    creator_id = request.query_params.get('creator_id', '').strip()
+    if creator_id.isdigit():
+        return f'creator-{int(creator_id)}', CREATOR_VERSION_KEY.format(int(creator_id))
+    return 'catalog', CATALOG_VERSION_KEY
+
+
+def normalize_query_params(request):
+    """
+    Returns the query parameters as a canonical string: sorted, stripped,
+    without empty values and with the search text lowercased.
+    """
+    normalized = []
+    for key, values in sorted(request.query_params.lists()):
+        values = sorted(value.strip() for value in values if value.strip())
+        if key == 'search':
+            values = [' '.join(value.lower().split()) for value in values]
+        if values:
+            normalized.append(f'{key}={"&".join(values)}')
+    return '&'.join(normalized)
+
+
+def get_cache_key(request, prefix=LIST_CACHE_KEY):
+    tag, version_key = get_scope(request)
+    query = f'{request.build_absolute_uri(request.path)}?{normalize_query_params(request)}'
+    digest = hashlib.md5(query.encode('utf-8')).hexdigest()
+    return prefix.format(tag=tag, version=get_version(version_key), digest=digest)
+
+
+def get_timeout():
+    return getattr(settings, 'OFFER_LIST_CACHE_TIMEOUT', 300)
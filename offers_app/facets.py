@@ -0,0 +1,85 @@
+"""
+Facet counts for the offer catalog.
+
+Counts are computed for a filtered OfferListing queryset with three
+grouped aggregate queries: one over the listings for the totals, the
+delivery time buckets and the price bands, one over the details for the
+offer types and one over the feature links for the top features.
+"""
+from django.apps import apps as global_apps
+from django.db.models import Count, Q
+
+DELIVERY_TIME_BUCKETS = [1, 3, 7, 14, 30]
+PRICE_BANDS = [(0, 50), (50, 100), (100, 250), (250, 500), (500, None)]
+TOP_FEATURES = 10
+
+
+def get_price_band_filter(lower, upper):
+    if upper is None:
+        return Q(min_price__gte=lower)
+    return Q(min_price__gte=lower, min_price__lt=upper)
+
+
+def count_offers(listings):
+    """
+    Returns the total and the counts per delivery time bucket and price
+    band. A delivery time bucket counts the offers that `max_delivery_time`
+    set to the bucket would return.
+    """
+    aggregates = {'count': Count('pk')}
+    for days in DELIVERY_TIME_BUCKETS:
+        aggregates[f'delivery_{days}'] = Count(
+            'pk', filter=Q(min_delivery_time__lte=days))
+    for index, (lower, upper) in enumerate(PRICE_BANDS):
+        aggregates[f'price_{index}'] = Count(
+            'pk', filter=get_price_band_filter(lower, upper))
+    counts = listings.order_by().aggregate(**aggregates)
+
+    return counts['count'], [
+        {'max_delivery_time': days, 'count': counts[f'delivery_{days}']}
+        for days in DELIVERY_TIME_BUCKETS
+    ], [
+        {'min_price': lower, 'max_price': upper, 'count': counts[f'price_{index}']}
+        for index, (lower, upper) in enumerate(PRICE_BANDS)
+    ]
+
+
+def count_offer_types(offer_ids, apps=global_apps):
+    """
+    Returns the number of offers having a detail of each offer type.
+    """
+    OfferDetail = apps.get_model('offers_app', 'OfferDetail')
+    counts = dict(OfferDetail.objects.filter(offer_id__in=offer_ids).values(
+        'offer_type').annotate(count=Count('offer_id', distinct=True)).values_list(
+        'offer_type', 'count').order_by())
+    return [{'offer_type': offer_type, 'count': counts.get(offer_type, 0)}
+            for offer_type, _ in OfferDetail.OFFER_TYPES]
+
+
+def count_top_features(offer_ids, limit=TOP_FEATURES, apps=global_apps):
+    """
+    Returns the `limit` feature names used by the most offers.
+    """
+    OfferDetail = apps.get_model('offers_app', 'OfferDetail')
+    Through = OfferDetail.features.through
+    rows = Through.objects.filter(offerdetail__offer_id__in=offer_ids).values(
+        'feature__name').annotate(count=Count('offerdetail__offer_id', distinct=True)).order_by(
+        '-count', 'feature__name')[:limit]
+    return [{'name': row['feature__name'], 'count': row['count']} for row in rows]
+
+
+def get_facets(listings, apps=global_apps):
+    """
+    Returns the facet counts of the offers in the given OfferListing queryset.
+    """
+    offer_ids = listings.order_by().values('offer_id')
+    # Counting over the ids drops annotations such as the search rank.
+    count, delivery_time, price = count_offers(
+        listings.model.objects.filter(offer_id__in=offer_ids))
+    return {
+        'count': count,
+        'delivery_time': delivery_time,
+        'price': price,
+        'offer_type': count_offer_types(offer_ids, apps=apps),
+        'features': count_top_features(offer_ids, apps=apps),
+    }
@@ -0,0 +1,73 @@
+"""
+Fragment cache for rendered offers.
+
+The rendered representation of every offer, offer detail and offer
+listing is cached under its primary key and `updated_at`. Writes move
+`updated_at` forward, so an outdated fragment is never read again and
+simply expires. Offers and listings also show the names of their user,
+so their keys carry a digest of those names as well: renaming a user
+retires the fragments of their offers without touching the offers.
+Responses are assembled from the fragments with one multi-get; only the
+misses are loaded and rendered.
+
+Fragments are rendered without a request, so image URLs are stored
+relative and made absolute when a response is assembled.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from offers_app.listing import get_user_details
+
+FRAGMENT_KEY = 'offers:fragment:{kind}:{pk}:{stamp}'
+USER_DETAILS = {
+    'offer': lambda offer: get_user_details(offer.user),
+    'listing': lambda listing: listing.user_details,
+}
+
+
+def get_user_version(user_details):
+    return hashlib.md5(json.dumps(
+        user_details, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def get_key(kind, obj):
+    stamp = obj.updated_at.isoformat()
+    if kind in USER_DETAILS:
+        stamp = f'{stamp}:{get_user_version(USER_DETAILS[kind](obj))}'
+    return FRAGMENT_KEY.format(kind=kind, pk=obj.pk, stamp=stamp)
+
+
+def get_timeout():
+    return getattr(settings, 'OFFER_FRAGMENT_CACHE_TIMEOUT', 3600)
+
+
+def get_fragments(kind, objects, render, prepare=None):
+    """
+    Returns the fragments of `objects` in order. The misses are passed to
+    `prepare` first, e.g. to prefetch what rendering needs, then rendered
+    with `render` and stored.
+    """
+    keys = [get_key(kind, obj) for obj in objects]
+    fragments = cache.get_many(keys) if keys else {}
+
+    missing = [(key, obj) for key, obj in zip(keys, objects) if key not in fragments]
+    if missing:
+        if prepare is not None:
+            prepare([obj for _, obj in missing])
+        rendered = {key: render(obj) for key, obj in missing}
+        cache.set_many(rendered, get_timeout())
+        fragments.update(rendered)
+    return [fragments[key] for key in keys]
+
+
+def with_absolute_image(fragment, request):
+    """
+    Returns a copy of `fragment` with an absolute image URL.
+    """
+    fragment = dict(fragment)
+    if request is not None and fragment.get('image'):
+        fragment['image'] = request.build_absolute_uri(fragment['image'])
+    return fragment
@@ -0,0 +1,339 @@
+"""
+In-process indexes over the offer catalog.
+
+- FeatureIndex maps every feature name to the ids of the offers linked to
+  it, i.e. having a detail with that feature. Feature filters are answered
+  with set intersections and unions, so the page query only has to look up
+  the matching offer ids.
+- TitleIndex keeps the distinct offer titles. Together with the feature
+  names of the FeatureIndex it serves prefix completions for the suggest
+  endpoint from sorted arrays.
+
+Every index is built on first use with one query. After that, changes
+are applied per offer, never by rebuilding the index on the request path:
+every change bumps a version in the cache and publishes the ids of the
+changed offers under the new version. The process that made the change
+updates its own index in place, the other processes reload the published
+offers on their next query. Both happen once the transaction commits, so
+rows of a transaction that is rolled back never reach an index. An index
+is only rebuilt when the changes it missed are no longer available, i.e.
+it is more than MAX_PENDING_CHANGES versions behind or they expired after
+CHANGES_TIMEOUT seconds.
+
+The versions and changes are kept in the default cache, which therefore
+has to be shared by all processes serving requests, e.g. memcached or
+Redis. With the local memory cache every process only sees its own
+changes, which is only correct when a single process serves requests.
+"""
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left, insort
+from collections import Counter
+from functools import partial
+
+from django.apps import apps as global_apps
+from django.core.cache import cache as default_cache
+from django.db import transaction
+
+from offers_app import cache
+
+FEATURE_INDEX_VERSION_KEY = 'offers:version:feature-index'
+TITLE_INDEX_VERSION_KEY = 'offers:version:title-index'
+INDEX_CHANGES_KEY = '{version_key}:changes:{version}'
+MAX_PENDING_CHANGES = 100
+CHANGES_TIMEOUT = 24 * 60 * 60
+SUGGEST_LIMIT = 5
+
+
+def normalize(text):
+    return text.casefold()
+
+
+class OfferIndex(ABC):
+    """
+    Base class of the in-process indexes. Subclasses load the indexed data
+    of the offers keyed by offer id and apply it to the index.
+    """
+    version_key = None
+
+    def __init__(self, apps=global_apps):
+        self.apps = apps
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.version = None
+        # Sorted (normalized text, text) pairs for prefix completion. While
+        # the index is rebuilt they are collected unsorted.
+        self.entries = []
+        self.building = False
+
+    def reset(self):
+        self.entries = []
+
+    @abstractmethod
+    def load(self, offer_ids=None):
+        """
+        Returns the indexed data of the given offers, or of all offers,
+        keyed by offer id.
+        """
+
+    @abstractmethod
+    def apply(self, data):
+        """
+        Replaces the indexed data of the offers in `data`. Returns whether
+        anything changed.
+        """
+
+    def add_entry(self, text):
+        if self.building:
+            self.entries.append((normalize(text), text))
+        else:
+            insort(self.entries, (normalize(text), text))
+
+    def remove_entry(self, text):
+        entry = (normalize(text), text)
+        index = bisect_left(self.entries, entry)
+        if index < len(self.entries) and self.entries[index] == entry:
+            del self.entries[index]
+
+    def get_changes_key(self, version):
+        return INDEX_CHANGES_KEY.format(version_key=self.version_key, version=version)
+
+    def ensure_current(self):
+        self.catch_up(cache.get_version(self.version_key))
+
+    def catch_up(self, version):
+        """
+        Brings the index to `version` by applying the changes published for
+        the versions in between. The index is only rebuilt when it was not
+        loaded yet or some of these changes are no longer available.
+        """
+        if self.loaded and self.version == version:
+            return
+        if self.loaded and 0 < version - self.version <= MAX_PENDING_CHANGES:
+            keys = [self.get_changes_key(pending)
+                    for pending in range(self.version + 1, version + 1)]
+            changes = default_cache.get_many(keys)
+            if len(changes) == len(keys):
+                offer_ids = set().union(*changes.values())
+                if offer_ids:
+                    self.apply(self.load(offer_ids))
+                self.version = version
+                return
+        self.rebuild()
+        self.loaded = True
+        self.version = version
+
+    def rebuild(self):
+        """
+        Builds the index from all offers. Only runs on first use and when
+        the index missed changes that are no longer available, see
+        `catch_up`. The entries are sorted once at the end instead of being
+        inserted in order one by one.
+        """
+        self.reset()
+        self.building = True
+        try:
+            self.apply(self.load())
+        finally:
+            self.building = False
+        self.entries.sort()
+
+    def refresh_offers(self, offer_ids):
+        """
+        Updates the index for the given offers and publishes them to the
+        other processes. Nothing is published when the index is loaded and
+        the data of the offers did not change. Must run outside of the
+        transaction that changed the offers.
+        Returns whether the version was bumped.
+        """
+        offer_ids = set(offer_ids)
+        with self.lock:
+            if self.loaded:
+                self.catch_up(cache.get_version(self.version_key))
+                if not self.apply(self.load(offer_ids)):
+                    return False
+            version = cache.bump_version(self.version_key)
+            default_cache.set(self.get_changes_key(version), offer_ids, CHANGES_TIMEOUT)
+            if self.loaded:
+                # Another process may have bumped the version in between.
+                self.catch_up(version - 1)
+                self.version = version
+            return True
+
+    def complete(self, prefix, limit=SUGGEST_LIMIT):
+        """
+        Returns up to `limit` indexed texts starting with `prefix`, ignoring
+        case, in alphabetical order.
+        """
+        prefix = normalize(prefix)
+        with self.lock:
+            self.ensure_current()
+            completions = []
+            index = bisect_left(self.entries, (prefix,))
+            while (len(completions) < limit and index < len(self.entries)
+                   and self.entries[index][0].startswith(prefix)):
+                completions.append(self.entries[index][1])
+                index += 1
+            return completions
+
+
+class FeatureIndex(OfferIndex):
+    """
+    Maps feature names to the ids of the offers using them.
+    """
+    version_key = FEATURE_INDEX_VERSION_KEY
+
+    def reset(self):
+        super().reset()
+        self.offers_by_feature = {}
+        self.features_by_offer = {}
+
+    def load(self, offer_ids=None):
+        OfferDetail = self.apps.get_model('offers_app', 'OfferDetail')
+        links = OfferDetail.features.through.objects.filter(offerdetail__offer__isnull=False)
+        features = {}
+        if offer_ids is not None:
+            links = links.filter(offerdetail__offer_id__in=offer_ids)
+            features = {offer_id: set() for offer_id in offer_ids}
+        for name, offer_id in links.values_list(
+                'feature__name', 'offerdetail__offer_id').distinct().order_by():
+            features.setdefault(offer_id, set()).add(name)
+        return features
+
+    def apply(self, features):
+        changed = False
+        for offer_id, names in features.items():
+            old_names = self.features_by_offer.pop(offer_id, set())
+            if names:
+                self.features_by_offer[offer_id] = names
+            for name in old_names - names:
+                offer_ids = self.offers_by_feature[name]
+                offer_ids.discard(offer_id)
+                if not offer_ids:
+                    del self.offers_by_feature[name]
+                    self.remove_entry(name)
+            for name in names - old_names:
+                if name not in self.offers_by_feature:
+                    self.offers_by_feature[name] = set()
+                    self.add_entry(name)
+                self.offers_by_feature[name].add(offer_id)
+            changed = changed or names != old_names
+        return changed
+
+    def offers_with_all(self, names):
+        """
+        Returns the ids of the offers linked to every one of `names`.
+        """
+        with self.lock:
+            self.ensure_current()
+            offer_sets = sorted((self.offers_by_feature.get(name, set()) for name in names),
+                                key=len)
+            if not offer_sets:
+                return set()
+            return offer_sets[0].intersection(*offer_sets[1:])
+
+    def offers_with_any(self, names):
+        """
+        Returns the ids of the offers linked to at least one of `names`.
+        """
+        with self.lock:
+            self.ensure_current()
+            return set().union(*(self.offers_by_feature.get(name, set()) for name in names))
+
+    def features_of(self, offer_ids):
+        """
+        Returns the feature names of each of the given offers.
+        """
+        with self.lock:
+            self.ensure_current()
+            return {offer_id: set(self.features_by_offer.get(offer_id, ()))
+                    for offer_id in offer_ids}
+
+    def jaccard_similarities(self, offer_ids):
+        """
+        Returns, for each of the given offers, the Jaccard similarity of its
+        feature set to that of every other offer sharing a feature with it.
+        """
+        with self.lock:
+            self.ensure_current()
+            similarities = {}
+            for offer_id in offer_ids:
+                names = self.features_by_offer.get(offer_id, set())
+                shared = Counter()
+                for name in names:
+                    shared.update(self.offers_by_feature[name])
+                shared.pop(offer_id, None)
+                similarities[offer_id] = {
+                    other_id: count / (len(names) + len(self.features_by_offer[other_id]) - count)
+                    for other_id, count in shared.items()
+                }
+            return similarities
+
+
+class TitleIndex(OfferIndex):
+    """
+    Keeps the distinct offer titles and how many offers use each.
+    """
+    version_key = TITLE_INDEX_VERSION_KEY
+
+    def reset(self):
+        super().reset()
+        self.title_by_offer = {}
+        self.offer_counts = {}
+
+    def load(self, offer_ids=None):
+        Offer = self.apps.get_model('offers_app', 'Offer')
+        offers = Offer.objects.order_by()
+        titles = {}
+        if offer_ids is not None:
+            offers = offers.filter(id__in=offer_ids)
+            titles = {offer_id: None for offer_id in offer_ids}
+        titles.update(offers.values_list('id', 'title'))
+        return titles
+
+    def apply(self, titles):
+        changed = False
+        for offer_id, title in titles.items():
+            old_title = self.title_by_offer.pop(offer_id, None)
+            if title:
+                self.title_by_offer[offer_id] = title
+            if title == old_title:
+                continue
+            changed = True
+            if old_title:
+                self.offer_counts[old_title] -= 1
+                if not self.offer_counts[old_title]:
+                    del self.offer_counts[old_title]
+                    self.remove_entry(old_title)
+            if title:
+                if title not in self.offer_counts:
+                    self.offer_counts[title] = 0
+                    self.add_entry(title)
+                self.offer_counts[title] += 1
+        return changed
+
+
+feature_index = FeatureIndex()
+title_index = TitleIndex()
+
+
+def reindex_offers(offer_ids):
+    """
+    Updates the in-process indexes for the given offers once the
+    transaction commits.
+    """
+    offer_ids = set(offer_ids)
+    if not offer_ids:
+        return
+    for index in (feature_index, title_index):
+        transaction.on_commit(partial(index.refresh_offers, offer_ids))
+
+
+def suggest(prefix, limit=SUGGEST_LIMIT):
+    """
+    Returns offer titles and feature names starting with `prefix`.
+    """
+    return {
+        'titles': title_index.complete(prefix, limit),
+        'features': feature_index.complete(prefix, limit),
+    }
@@ -0,0 +1,132 @@
+"""
+Maintenance of the `OfferListing` read model.
+
+A listing row is a flat copy of everything the offer list endpoint
+returns for an offer. Rows are rebuilt from the offer tables with a fixed
+number of queries per chunk of offers. The business rating of a row is
+kept separately by `refresh_business_ratings`, as it follows the reviews
+of the user rather than the offer.
+"""
+from django.apps import apps as global_apps
+from django.db.models import Avg, OuterRef, Subquery
+
+CHUNK_SIZE = 500
+LISTING_FIELDS = ['user', 'title', 'image', 'description', 'created_at', 'updated_at',
+                  'min_price', 'min_delivery_time', 'user_details', 'details']
+
+
+def get_user_details(user):
+    return {
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "username": user.username,
+    }
+
+
+def get_detail_links(detail_ids):
+    return [{"id": detail_id, "url": f"/offerdetails/{detail_id}/"} for detail_id in detail_ids]
+
+
+def build_listings(offer_ids, apps=global_apps):
+    """
+    Returns unsaved OfferListing instances for the given offers.
+    """
+    Offer = apps.get_model('offers_app', 'Offer')
+    OfferDetail = apps.get_model('offers_app', 'OfferDetail')
+    OfferListing = apps.get_model('offers_app', 'OfferListing')
+
+    detail_ids = {}
+    for offer_id, detail_id in OfferDetail.objects.filter(
+            offer_id__in=offer_ids).order_by('id').values_list('offer_id', 'id'):
+        detail_ids.setdefault(offer_id, []).append(detail_id)
+
+    return [
+        OfferListing(
+            offer_id=offer.id,
+            user_id=offer.user_id,
+            title=offer.title,
+            image=offer.image.name,
+            description=offer.description,
+            created_at=offer.created_at,
+            updated_at=offer.updated_at,
+            min_price=offer.min_price,
+            min_delivery_time=offer.min_delivery_time,
+            user_details=get_user_details(offer.user),
+            details=get_detail_links(detail_ids.get(offer.id, [])),
+        )
+        for offer in Offer.objects.filter(id__in=offer_ids).select_related('user')
+    ]
+
+
+def rebuild_listings(offer_ids, apps=global_apps):
+    """
+    Rewrites the listing rows of the given offers. Rows of offers that no
+    longer exist are removed.
+    """
+    OfferListing = apps.get_model('offers_app', 'OfferListing')
+
+    offer_ids = sorted(set(offer_ids))
+    for start in range(0, len(offer_ids), CHUNK_SIZE):
+        chunk = offer_ids[start:start + CHUNK_SIZE]
+        listings = build_listings(chunk, apps=apps)
+        existing = {listing.offer_id for listing in listings}
+        missing = [offer_id for offer_id in chunk if offer_id not in existing]
+        if missing:
+            OfferListing.objects.filter(offer_id__in=missing).delete()
+        if listings:
+            OfferListing.objects.bulk_create(
+                listings, update_conflicts=True, unique_fields=['offer'],
+                update_fields=LISTING_FIELDS)
+
+
+def rebuild_all_listings(apps=global_apps):
+    """
+    Rebuilds the listing rows of every offer and drops stale rows.
+    Returns the number of listings written.
+    """
+    Offer = apps.get_model('offers_app', 'Offer')
+    OfferListing = apps.get_model('offers_app', 'OfferListing')
+
+    OfferListing.objects.exclude(
+        offer_id__in=Offer.objects.values('id')).delete()
+    offer_ids = list(Offer.objects.values_list('id', flat=True))
+    rebuild_listings(offer_ids, apps=apps)
+    return len(offer_ids)
+
+
+def refresh_user_details(user, apps=global_apps):
+    """
+    Copies the current names of `user` into the listings of their offers.
+    Returns the number of listings updated.
+    """
+    OfferListing = apps.get_model('offers_app', 'OfferListing')
+    return OfferListing.objects.filter(user=user).update(
+        user_details=get_user_details(user))
+
+
+def copy_min_values(updated_at, apps=global_apps):
+    """
+    Copies `min_price`, `min_delivery_time` and `updated_at` of the offers
+    updated at `updated_at` into their listings with one UPDATE statement.
+    Returns the number of listings updated.
+    """
+    Offer = apps.get_model('offers_app', 'Offer')
+    OfferListing = apps.get_model('offers_app', 'OfferListing')
+    offer = Offer.objects.filter(pk=OuterRef('offer_id'))
+    return OfferListing.objects.filter(offer__updated_at=updated_at).update(
+        min_price=Subquery(offer.values('min_price')),
+        min_delivery_time=Subquery(offer.values('min_delivery_time')),
+        updated_at=updated_at)
+
+
+def refresh_business_ratings(apps=global_apps, **filters):
+    """
+    Sets `business_rating` of the listings matching `filters` to the
+    average review rating of their user with one UPDATE statement.
+    Returns the number of listings updated.
+    """
+    OfferListing = apps.get_model('offers_app', 'OfferListing')
+    Review = apps.get_model('reviews_app', 'Review')
+    rating = Review.objects.filter(business_user_id=OuterRef('user_id')).order_by().values(
+        'business_user_id').annotate(value=Avg('rating')).values('value')
+    return OfferListing.objects.filter(**filters).update(business_rating=Subquery(rating))
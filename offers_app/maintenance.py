@@ -0,0 +1,54 @@
+"""
+Maintenance jobs for the offers app.
+
+The jobs are plain functions so they can be run from a management command,
+a cron entry or any task scheduler.
+"""
+from datetime import timedelta
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.deletion import Collector
+from django.utils import timezone
+
+from offers_app.models import Feature
+
+CHUNK_SIZE = 500
+GRACE_PERIOD = timedelta(minutes=5)
+
+
+def collect_orphaned_features(chunk_size=CHUNK_SIZE, using=DEFAULT_DB_ALIAS,
+                              grace_period=GRACE_PERIOD):
+    """
+    Deletes the features no offer detail uses, in chunks of
+    at most `chunk_size` features with one transaction per chunk.
+    Returns the number of deleted features.
+
+    Features created within the last `grace_period` are kept: an offer
+    that is being created may have resolved them without having linked
+    them yet. The candidates of a chunk are locked and checked again
+    before they are deleted, so a link inserted in the meantime keeps
+    its feature.
+    """
+    created_before = timezone.now() - grace_period
+    reclaimed, last_id = 0, 0
+    while True:
+        with transaction.atomic(using=using):
+            feature_ids = list(Feature.objects.using(using).orphaned().filter(
+                id__gt=last_id, created_at__lt=created_before,
+            ).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not feature_ids:
+                return reclaimed
+            last_id = feature_ids[-1]
+            # Waits for the transactions linking one of the features.
+            list(Feature.objects.using(using).select_for_update().filter(
+                id__in=feature_ids).values_list('id', flat=True))
+            features = list(Feature.objects.using(using).orphaned().filter(
+                id__in=feature_ids).order_by('id'))
+            for feature in features:
+                # Orphaned features belong to no offer, so there is nothing
+                # for the search receivers to look up.
+                feature._changed_offer_ids = []
+            collector = Collector(using=using)
+            collector.collect(features)
+            collector.delete()
+        reclaimed += len(features)
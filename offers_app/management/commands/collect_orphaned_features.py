@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from offers_app import maintenance
+
+
+class Command(BaseCommand):
+    help = 'Deletes features that are used by no offer detail.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=maintenance.CHUNK_SIZE,
+            help='Maximum number of features deleted per transaction.')
+        parser.add_argument(
+            '--grace-minutes', type=int,
+            default=int(maintenance.GRACE_PERIOD.total_seconds() // 60),
+            help='Keeps features created within the last minutes.')
+
+    def handle(self, *args, **options):
+        count = maintenance.collect_orphaned_features(
+            chunk_size=options['chunk_size'],
+            grace_period=timedelta(minutes=options['grace_minutes']))
+        self.stdout.write(self.style.SUCCESS(
+            f'Reclaimed {count} orphaned features.'))
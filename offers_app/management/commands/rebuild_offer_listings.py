@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from offers_app import listing
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the OfferListing read model for all offers.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = listing.rebuild_all_listings()
+            listing.refresh_business_ratings()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {count} offer listings.'))
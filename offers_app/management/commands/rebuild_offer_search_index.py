@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from offers_app import search
+
+
+class Command(BaseCommand):
+    help = 'Recreates the full-text search index for all offers.'
+
+    def handle(self, *args, **options):
+        if search.get_backend() is None:
+            self.stdout.write(self.style.WARNING(
+                'The database has no full-text index, nothing to rebuild.'))
+            return
+        search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Offer search index rebuilt.'))
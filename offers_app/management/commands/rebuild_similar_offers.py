@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from offers_app import similarity
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the similar offers of all offers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=similarity.CHUNK_SIZE,
+            help='Number of offers whose neighbors are computed and written at once.')
+
+    def handle(self, *args, **options):
+        count = similarity.rebuild_similar_offers(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {count} similar offers.'))
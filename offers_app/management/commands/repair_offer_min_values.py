@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from offers_app import cache, listing
+from offers_app.models import Offer
+
+
+class Command(BaseCommand):
+    help = 'Recomputes min_price and min_delivery_time of all offers from their details.'
+
+    def handle(self, *args, **options):
+        updated_at = timezone.now()
+        with transaction.atomic():
+            count = Offer.objects.update_min_values(updated_at=updated_at)
+            if count:
+                listing.copy_min_values(updated_at)
+                cache.invalidate_offers(Offer.objects.filter(
+                    updated_at=updated_at).values_list('user_id', flat=True).distinct())
+        self.stdout.write(self.style.SUCCESS(
+            f'Repaired the minimum values of {count} offers.'))
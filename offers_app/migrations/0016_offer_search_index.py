@@ -0,0 +1,33 @@
+from django.db import migrations
+
+from offers_app import search
+
+
+def create_search_index(apps, schema_editor):
+    backend = search.get_backend(schema_editor.connection)
+    if backend is None:
+        return
+    with schema_editor.connection.cursor() as cursor:
+        backend.create_index(cursor)
+    Offer = apps.get_model('offers_app', 'Offer')
+    search.reindex_offers(Offer.objects.values_list('id', flat=True),
+                          apps=apps, connection=schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    backend = search.get_backend(schema_editor.connection)
+    if backend is None:
+        return
+    with schema_editor.connection.cursor() as cursor:
+        backend.drop_index(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers_app', '0015_alter_offer_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
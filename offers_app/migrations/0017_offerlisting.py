@@ -0,0 +1,39 @@
+# Generated by Django 5.1.3 on 2026-10-18 04:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from offers_app import listing
+
+
+def build_listings(apps, schema_editor):
+    listing.rebuild_all_listings(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers_app', '0016_offer_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OfferListing',
+            fields=[
+                ('offer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing', serialize=False, to='offers_app.offer')),
+                ('title', models.CharField(max_length=100)),
+                ('image', models.ImageField(blank=True, null=True, upload_to='images')),
+                ('description', models.TextField()),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('min_delivery_time', models.PositiveIntegerField(blank=True, null=True)),
+                ('user_details', models.JSONField(default=dict)),
+                ('details', models.JSONField(default=list)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(build_listings, migrations.RunPython.noop),
+    ]
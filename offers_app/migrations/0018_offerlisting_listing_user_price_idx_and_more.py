@@ -0,0 +1,35 @@
+# Generated by Django 5.1.3 on 2026-10-18 04:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers_app', '0017_offerlisting'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='offerlisting',
+            index=models.Index(fields=['user', 'min_price', 'offer'], name='listing_user_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offerlisting',
+            index=models.Index(fields=['user', 'updated_at', 'offer'], name='listing_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offerlisting',
+            index=models.Index(fields=['min_price', 'offer'], name='listing_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offerlisting',
+            index=models.Index(fields=['updated_at', 'offer'], name='listing_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offerlisting',
+            index=models.Index(fields=['min_delivery_time'], name='listing_delivery_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-18 04:12
+
+import offers_app.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers_app', '0018_offerlisting_listing_user_price_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='offerdetail',
+            name='offer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=offers_app.models.cascade_with_orphaned_features, related_name='details', to='offers_app.offer'),
+        ),
+    ]
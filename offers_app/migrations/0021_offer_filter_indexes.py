@@ -0,0 +1,36 @@
+# Generated by Django 5.1.3 on 2026-10-18 04:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+from offers_app import listing
+
+
+def fill_business_ratings(apps, schema_editor):
+    listing.refresh_business_ratings(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers_app', '0020_offerdetail_updated_at'),
+        ('reviews_app', '0010_review_review_business_updated_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='offerlisting',
+            name='business_rating',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='offerdetail',
+            index=models.Index(fields=['offer_type', 'offer'], name='offerdetail_type_offer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offerlisting',
+            index=models.Index(fields=['business_rating', 'min_price'], name='listing_rating_price_idx'),
+        ),
+        migrations.RunPython(fill_business_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.3 on 2026-10-18 04:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers_app', '0021_offer_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarOffer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('offer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_offers', to='offers_app.offer')),
+                ('similar', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='offers_app.offer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['offer', '-score'], name='similar_offer_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('offer', 'similar'), name='unique_similar_offer')],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.3 on 2026-10-18 05:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers_app', '0022_similaroffer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feature',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-18 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers_app', '0023_feature_created_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='similaroffer',
+            index=models.Index(fields=['similar', '-score'], name='similar_offer_similar_idx'),
+        ),
+    ]
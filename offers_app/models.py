@@ -1,22 +1,137 @@
-from django.db import models
+from django.db import models, router
+from django.db.models import Exists, F, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.deletion import Collector
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+from offers_app.signals import batch_offer_changes
+
+
+class FeatureQuerySet(models.QuerySet):
+    def resolve(self, names):
+        """
+        Returns a dict mapping each of the given names to its Feature,
+        creating the missing ones. Costs one SELECT when all names exist,
+        otherwise one SELECT, one bulk INSERT and one SELECT of the new rows.
+        """
+        names = list(dict.fromkeys(name for name in names if name))
+        if not names:
+            return {}
+
+        features = {feature.name: feature for feature in self.filter(name__in=names)}
+        missing = [name for name in names if name not in features]
+        if missing:
+            self.bulk_create([Feature(name=name) for name in missing],
+                             ignore_conflicts=True)
+            features.update(
+                (feature.name, feature) for feature in self.filter(name__in=missing))
+        return features
+
+    def orphaned(self):
+        """
+        Returns the features no offer detail uses.
+        """
+        Through = OfferDetail.features.through
+        return self.exclude(
+            Exists(Through.objects.filter(feature_id=OuterRef('pk'))))
+
+    def orphaned_by(self, details):
+        """
+        Returns the features linked to `details` that no other offer detail
+        uses, i.e. the features left over once `details` are deleted.
+        `details` may be a queryset or a list of offer details.
+        """
+        Through = OfferDetail.features.through
+        used_elsewhere = Through.objects.filter(
+            feature_id=OuterRef('pk')).exclude(offerdetail__in=details)
+        return self.filter(
+            id__in=Through.objects.filter(
+                offerdetail__in=details).values('feature_id')
+        ).exclude(Exists(used_elsewhere))
+
+
+def collect_orphaned_features(collector, details):
+    """
+    Adds the features orphaned by deleting `details` to the collector, so
+    they are removed in the same set-based deletion as the details.
+    """
+    features = list(Feature.objects.using(collector.using).orphaned_by(details))
+    for feature in features:
+        # No offer outside of this deletion uses the feature, so the search
+        # receivers do not need to look up the offers it belonged to.
+        feature._changed_offer_ids = []
+    if features:
+        collector.collect(features)
+
+
+def cascade_with_orphaned_features(collector, field, sub_objs, using):
+    """
+    on_delete handler of OfferDetail.offer: cascades like CASCADE and also
+    deletes the features only the cascaded details used.
+    """
+    models.CASCADE(collector, field, sub_objs, using)
+    collect_orphaned_features(collector, sub_objs)
+
+
+class OfferDetailQuerySet(models.QuerySet):
+    def delete(self):
+        """
+        Deletes the details together with the features only they use.
+        """
+        collector = Collector(using=self.db, origin=self)
+        collector.collect(self)
+        collect_orphaned_features(collector, self)
+        return collector.delete()
+
 
 class Feature(models.Model):
     """
     Model representing a feature.
     Attributes:
         name (str): The name of the feature. It must be unique and can have a maximum length of 50 characters.
+        created_at (DateTimeField): The date and time when the feature was created, automatically set on creation.
     Methods:
         __str__(): Returns the string representation of the feature, which is its name.
     """
     name = models.CharField(max_length=50, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = FeatureQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
 
+class OfferQuerySet(models.QuerySet):
+    def update_min_values(self, updated_at=None):
+        """
+        Recomputes `min_price` and `min_delivery_time` of the offers from
+        their details with a single UPDATE ... subquery statement. Only
+        offers whose values change are written; their `updated_at` is set
+        to `updated_at` (default: now). Returns the number of offers updated.
+        """
+        details = OfferDetail.objects.filter(
+            offer_id=OuterRef('pk')).order_by().values('offer_id')
+        min_price = Subquery(details.annotate(value=Min('price')).values('value'))
+        min_delivery_time = Subquery(details.annotate(
+            value=Min('delivery_time_in_days')).values('value'))
+
+        # Prices and delivery times are never negative, so -1 stands for NULL.
+        price_field = self.model._meta.get_field('min_price')
+        changed = self.alias(
+            current_price=Coalesce('min_price', Value(-1), output_field=price_field),
+            wanted_price=Coalesce(min_price, Value(-1), output_field=price_field),
+            current_delivery_time=Coalesce('min_delivery_time', Value(-1)),
+            wanted_delivery_time=Coalesce(min_delivery_time, Value(-1)),
+        ).exclude(current_price=F('wanted_price'),
+                  current_delivery_time=F('wanted_delivery_time'))
+        return changed.update(
+            min_price=min_price, min_delivery_time=min_delivery_time,
+            updated_at=updated_at or timezone.now())
+
+
 class Offer(models.Model):
     """
     Model representing an offer.
@@ -45,10 +160,11 @@ class Offer(models.Model):
         max_digits=10, decimal_places=2, blank=True, null=True)
     min_delivery_time = models.PositiveIntegerField(blank=True, null=True)
 
+    objects = OfferQuerySet.as_manager()
+
     def delete(self, *args, **kwargs):
-        for detail in self.details.all():
-            detail.delete()
-        super().delete(*args, **kwargs)
+        with batch_offer_changes():
+            return super().delete(*args, **kwargs)
 
     def __str__(self):
         return self.title
@@ -64,6 +180,7 @@ class OfferDetail(models.Model):
         price (Decimal): The price of the offer.
         features (ManyToManyField): The features included in the offer, chosen from predefined options.
         offer_type (str): The type of the offer, chosen from predefined options.
+        updated_at (DateTimeField): The date and time when the detail or its features were last changed.
     """
 
     OFFER_TYPES = [
@@ -81,13 +198,108 @@ class OfferDetail(models.Model):
     offer_type = models.CharField(
         max_length=20, choices=OFFER_TYPES, default="basic")
     offer = models.ForeignKey(
-        Offer, related_name='details', on_delete=models.CASCADE, null=True, blank=True)
+        Offer, related_name='details', on_delete=cascade_with_orphaned_features,
+        null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
-    def delete(self, *args, **kwargs):
-        for feature in self.features.all():
-            if not feature.offerdetail_set.exclude(pk=self.pk).exists():
-                feature.delete()
-        super().delete(*args, **kwargs)
+    objects = OfferDetailQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['offer_type', 'offer'],
+                         name='offerdetail_type_offer_idx'),
+        ]
+
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(self.__class__, instance=self)
+        collector = Collector(using=using, origin=self)
+        collector.collect([self], keep_parents=keep_parents)
+        collect_orphaned_features(collector, [self])
+        return collector.delete()
 
     def __str__(self):
         return f"({self.id}) {self.title}"
+
+
+class OfferListing(models.Model):
+    """
+    Read model holding the payload of an offer in the offer list.
+    Attributes:
+        offer (OneToOneField): The offer this row describes, also its primary key.
+        user (ForeignKey): The user who created the offer.
+        title, image, description, created_at, updated_at, min_price, min_delivery_time:
+            Copies of the offer fields.
+        user_details (JSONField): The first name, last name and username of the user.
+        details (JSONField): The id and url of every detail of the offer.
+        business_rating (FloatField): The average review rating of the user, None without reviews.
+    The rows are rebuilt from the offer tables by `offers_app.listing` whenever an
+    offer, one of its details or its user changes, so listing offers needs no joins.
+    """
+    offer = models.OneToOneField(
+        Offer, primary_key=True, on_delete=models.CASCADE, related_name='listing')
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+')
+    title = models.CharField(max_length=100)
+    image = models.ImageField(
+        upload_to='images', null=True, blank=True)
+    description = models.TextField()
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    min_price = models.DecimalField(
+        max_digits=10, decimal_places=2, blank=True, null=True)
+    min_delivery_time = models.PositiveIntegerField(blank=True, null=True)
+    user_details = models.JSONField(default=dict)
+    details = models.JSONField(default=list)
+    business_rating = models.FloatField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'min_price', 'offer'],
+                         name='listing_user_price_idx'),
+            models.Index(fields=['user', 'updated_at', 'offer'],
+                         name='listing_user_updated_idx'),
+            models.Index(fields=['min_price', 'offer'],
+                         name='listing_price_idx'),
+            models.Index(fields=['updated_at', 'offer'],
+                         name='listing_updated_idx'),
+            models.Index(fields=['min_delivery_time'],
+                         name='listing_delivery_idx'),
+            models.Index(fields=['business_rating', 'min_price'],
+                         name='listing_rating_price_idx'),
+        ]
+
+    def __str__(self):
+        return self.title
+
+
+class SimilarOffer(models.Model):
+    """
+    Precomputed neighbor of an offer for the "similar offers" endpoint.
+    Attributes:
+        offer (ForeignKey): The offer the neighbor belongs to.
+        similar (ForeignKey): The neighboring offer.
+        score (FloatField): The similarity of the two offers, between 0 and 1.
+    The rows are computed by `offers_app.similarity` from the feature sets and
+    minimum prices of the offers. Rows pointing to a deleted offer are removed
+    once the deletion commits, so `similar` has no database constraint.
+    """
+    offer = models.ForeignKey(
+        Offer, on_delete=models.CASCADE, related_name='similar_offers')
+    similar = models.ForeignKey(
+        Offer, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['offer', 'similar'],
+                                    name='unique_similar_offer'),
+        ]
+        indexes = [
+            models.Index(fields=['offer', '-score'],
+                         name='similar_offer_score_idx'),
+            models.Index(fields=['similar', '-score'],
+                         name='similar_offer_similar_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.offer_id} ~ {self.similar_id}"
@@ -0,0 +1,262 @@
+"""
+Full-text search index for offers.
+
+Every offer is stored as one document made of its title, description and
+the names of the features of its details. The document lives in a side
+table keyed by the offer id:
+
+- SQLite: an FTS5 virtual table, ranked with bm25().
+- PostgreSQL: a tsvector column with a GIN index, ranked with ts_rank().
+
+A search runs the full-text match once, as a derived table of the
+matching offer ids and their ranks, and joins it to the searched table.
+
+On any other database the search falls back to plain `icontains` lookups
+on the offers. The index is kept in sync by the receivers in
+`offers_app.signals`.
+"""
+import re
+
+from django.apps import apps as global_apps
+from django.db import connection as default_connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.sql.constants import INNER
+
+SEARCH_TABLE = 'offers_app_offer_search'
+SEARCH_ALIAS = 'offer_search'
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+CHUNK_SIZE = 500
+
+
+class SQLiteSearchBackend:
+    """
+    FTS5 index. The rowid of a document is the id of its offer.
+    """
+    weights = '10.0, 1.0, 5.0'
+
+    def create_index(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "title, description, features, tokenize='unicode61 remove_diacritics 2')")
+
+    def drop_index(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def delete_documents(self, cursor, offer_ids):
+        placeholders = ', '.join(['%s'] * len(offer_ids))
+        cursor.execute(
+            f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", offer_ids)
+
+    def insert_documents(self, cursor, documents):
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, title, description, features) "
+            "VALUES (%s, %s, %s, %s)", documents)
+
+    def build_query(self, tokens):
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def match_sql(self):
+        return (
+            f"SELECT rowid AS offer_id, bm25({SEARCH_TABLE}, {self.weights}) AS rank "
+            f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s")
+
+
+class PostgresSearchBackend:
+    """
+    tsvector index with a GIN index. Title, features and description are
+    weighted A, B and C. Ranks are negated so that ascending order is best
+    first, like bm25() on SQLite.
+    """
+    config = 'simple'
+
+    def create_index(self, cursor):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            "offer_id bigint PRIMARY KEY, document tsvector NOT NULL)")
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx "
+            f"ON {SEARCH_TABLE} USING GIN (document)")
+
+    def drop_index(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def delete_documents(self, cursor, offer_ids):
+        placeholders = ', '.join(['%s'] * len(offer_ids))
+        cursor.execute(
+            f"DELETE FROM {SEARCH_TABLE} WHERE offer_id IN ({placeholders})", offer_ids)
+
+    def insert_documents(self, cursor, documents):
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (offer_id, document) VALUES (%s, "
+            f"setweight(to_tsvector('{self.config}', %s), 'A') || "
+            f"setweight(to_tsvector('{self.config}', %s), 'C') || "
+            f"setweight(to_tsvector('{self.config}', %s), 'B'))", documents)
+
+    def build_query(self, tokens):
+        return ' & '.join(f'{token}:*' for token in tokens)
+
+    def match_sql(self):
+        return (
+            f"SELECT offer_id, -ts_rank(document, to_tsquery('{self.config}', %s)) AS rank "
+            f"FROM {SEARCH_TABLE} WHERE document @@ to_tsquery('{self.config}', %s)")
+
+
+class SearchJoin:
+    """
+    INNER JOIN of the derived table of matching offer ids and ranks to the
+    searched table, on its primary key. Implements the interface the query
+    compiler expects of `django.db.models.sql.datastructures.Join`.
+    """
+    join_type = INNER
+    nullable = False
+    filtered_relation = None
+
+    def __init__(self, match_sql, params, parent_alias, pk_column, table_alias=SEARCH_ALIAS):
+        self.match_sql = match_sql
+        self.params = params
+        self.parent_alias = parent_alias
+        self.pk_column = pk_column
+        self.table_name = SEARCH_ALIAS
+        self.table_alias = table_alias
+
+    def as_sql(self, compiler, connection):
+        qn = compiler.quote_name_unless_alias
+        return (
+            f"INNER JOIN ({self.match_sql}) {self.table_alias} "
+            f"ON ({self.table_alias}.offer_id = "
+            f"{qn(self.parent_alias)}.{connection.ops.quote_name(self.pk_column)})",
+            list(self.params))
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(
+            self.match_sql, self.params, change_map.get(self.parent_alias, self.parent_alias),
+            self.pk_column, change_map.get(self.table_alias, self.table_alias))
+
+    @property
+    def identity(self):
+        return (self.__class__, self.match_sql, tuple(self.params),
+                self.parent_alias, self.pk_column)
+
+    def __eq__(self, other):
+        return isinstance(other, SearchJoin) and self.identity == other.identity
+
+    def __hash__(self):
+        return hash(self.identity)
+
+    def equals(self, other):
+        return self == other
+
+    def demote(self):
+        return self
+
+    def promote(self):
+        return self
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(connection=default_connection):
+    """
+    Returns the search backend for the given connection, or None if the
+    database has no supported full-text index.
+    """
+    backend_class = BACKENDS.get(connection.vendor)
+    return backend_class() if backend_class else None
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN_PATTERN.findall(text or '')]
+
+
+def build_documents(offer_ids, apps=global_apps):
+    """
+    Returns (offer_id, title, description, features) tuples for the given
+    offers with two queries.
+    """
+    Offer = apps.get_model('offers_app', 'Offer')
+    OfferDetail = apps.get_model('offers_app', 'OfferDetail')
+
+    features = {}
+    feature_rows = OfferDetail.features.through.objects.filter(
+        offerdetail__offer_id__in=offer_ids
+    ).values_list('offerdetail__offer_id', 'feature__name').distinct()
+    for offer_id, name in feature_rows:
+        features.setdefault(offer_id, []).append(name)
+
+    return [
+        (offer_id, title, description, ' '.join(features.get(offer_id, [])))
+        for offer_id, title, description in Offer.objects.filter(
+            id__in=offer_ids).values_list('id', 'title', 'description')
+    ]
+
+
+def reindex_offers(offer_ids, apps=global_apps, connection=default_connection):
+    """
+    Rewrites the index documents of the given offers. Ids of offers that no
+    longer exist are removed from the index.
+    """
+    backend = get_backend(connection)
+    if backend is None:
+        return
+
+    offer_ids = sorted(set(offer_ids))
+    with connection.cursor() as cursor:
+        for start in range(0, len(offer_ids), CHUNK_SIZE):
+            chunk = offer_ids[start:start + CHUNK_SIZE]
+            backend.delete_documents(cursor, chunk)
+            documents = build_documents(chunk, apps=apps)
+            if documents:
+                backend.insert_documents(cursor, documents)
+
+
+def rebuild_index(apps=global_apps, connection=default_connection):
+    """
+    Recreates the index from scratch for every offer.
+    """
+    backend = get_backend(connection)
+    if backend is None:
+        return
+
+    with connection.cursor() as cursor:
+        backend.drop_index(cursor)
+        backend.create_index(cursor)
+    Offer = apps.get_model('offers_app', 'Offer')
+    reindex_offers(Offer.objects.values_list('id', flat=True),
+                   apps=apps, connection=connection)
+
+
+def search_offers(queryset, text):
+    """
+    Restricts the queryset to offers matching every word of `text` (as a
+    prefix) and annotates it with `search_rank`, where lower is better.
+    Text without any word matches nothing.
+    The queryset may be over any model whose primary key is the offer id.
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return queryset.none()
+
+    backend = get_backend(default_connection)
+    if backend is None:
+        Offer = global_apps.get_model('offers_app', 'Offer')
+        offers = Offer.objects.all()
+        for token in tokens:
+            offers = offers.filter(
+                Q(title__icontains=token)
+                | Q(description__icontains=token)
+                | Q(details__features__name__icontains=token))
+        return queryset.filter(pk__in=offers.values('pk'))
+
+    match_sql = backend.match_sql()
+    queryset = queryset.all()
+    query = queryset.query
+    alias = query.join(SearchJoin(
+        match_sql, [backend.build_query(tokens)] * match_sql.count('%s'),
+        query.get_initial_alias(), queryset.model._meta.pk.column))
+    return queryset.annotate(
+        search_rank=RawSQL(f'{alias}.rank', [], output_field=FloatField()))
@@ -0,0 +1,170 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from offers_app import cache, indexes, listing, search, similarity
+
+USER_DETAIL_FIELDS = ('first_name', 'last_name', 'username')
+
+_state = threading.local()
+
+
+@contextmanager
+def batch_offer_changes():
+    """
+    Collects the ids of offers changed inside the block and dispatches them
+    once when the block exits. Nested blocks join the outermost one.
+    Nothing is dispatched if the block raises.
+    """
+    if getattr(_state, 'pending', None) is not None:
+        yield
+        return
+
+    _state.pending = (set(), set())
+    try:
+        yield
+        offer_ids, user_ids = _state.pending
+    finally:
+        _state.pending = None
+    if offer_ids or user_ids:
+        dispatch_offer_changes(offer_ids, user_ids)
+
+
+def offers_changed(offer_ids, user_ids=()):
+    """
+    Records that the given offers were created, updated or deleted.
+    `user_ids` names creators that can no longer be looked up from the
+    offers, e.g. because the offer was deleted.
+    """
+    offer_ids = {offer_id for offer_id in offer_ids if offer_id is not None}
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not offer_ids and not user_ids:
+        return
+    pending = getattr(_state, 'pending', None)
+    if pending is not None:
+        pending[0].update(offer_ids)
+        pending[1].update(user_ids)
+    else:
+        dispatch_offer_changes(offer_ids, user_ids)
+
+
+def dispatch_offer_changes(offer_ids, user_ids=()):
+    from offers_app.models import Offer
+
+    user_ids = set(user_ids)
+    if offer_ids:
+        user_ids.update(Offer.objects.filter(
+            id__in=offer_ids).values_list('user_id', flat=True))
+        listing.rebuild_listings(offer_ids)
+        listing.refresh_business_ratings(offer_id__in=offer_ids)
+        search.reindex_offers(offer_ids)
+        indexes.reindex_offers(offer_ids)
+        similarity.queue_similar_offers_update(offer_ids)
+    cache.invalidate_offers(user_ids)
+
+
+def _offer_ids_of_details(detail_ids):
+    from offers_app.models import OfferDetail
+    return OfferDetail.objects.filter(
+        id__in=detail_ids).values_list('offer_id', flat=True)
+
+
+def _touch_offer_details(**filters):
+    """
+    Moves `updated_at` of the matching details forward, so their cached
+    fragments are no longer used, see `offers_app.fragments`.
+    """
+    from offers_app.models import OfferDetail
+    OfferDetail.objects.filter(**filters).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender='offers_app.Offer')
+@receiver(post_delete, sender='offers_app.Offer')
+def offer_changed(sender, instance, **kwargs):
+    offers_changed([instance.pk], [instance.user_id])
+
+
+@receiver(post_save, sender='offers_app.OfferDetail')
+@receiver(post_delete, sender='offers_app.OfferDetail')
+def offer_detail_changed(sender, instance, **kwargs):
+    offers_changed([instance.offer_id])
+
+
+@receiver(m2m_changed, sender='offers_app.OfferDetail_features')
+def offer_detail_features_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        if action == 'pre_clear':
+            instance._changed_offer_ids = list(
+                instance.offerdetail_set.values_list('offer_id', flat=True))
+        elif action == 'post_clear':
+            changed_offer_ids = getattr(instance, '_changed_offer_ids', [])
+            _touch_offer_details(offer_id__in=changed_offer_ids)
+            offers_changed(changed_offer_ids)
+        elif action in ('post_add', 'post_remove'):
+            _touch_offer_details(id__in=pk_set)
+            offers_changed(_offer_ids_of_details(pk_set))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        _touch_offer_details(pk=instance.pk)
+        offers_changed([instance.offer_id])
+
+
+@receiver(post_save, sender='offers_app.Feature')
+def feature_saved(sender, instance, created, **kwargs):
+    if not created:
+        _touch_offer_details(features=instance)
+        offers_changed(instance.offerdetail_set.values_list(
+            'offer_id', flat=True))
+
+
+@receiver(pre_delete, sender='offers_app.Feature')
+def feature_deleting(sender, instance, **kwargs):
+    if not hasattr(instance, '_changed_offer_ids'):
+        instance._changed_offer_ids = list(
+            instance.offerdetail_set.values_list('offer_id', flat=True))
+        if instance._changed_offer_ids:
+            _touch_offer_details(features=instance)
+
+
+@receiver(post_delete, sender='offers_app.Feature')
+def feature_deleted(sender, instance, **kwargs):
+    offers_changed(getattr(instance, '_changed_offer_ids', []))
+
+
+@receiver(post_save, sender='reviews_app.Review')
+@receiver(post_delete, sender='reviews_app.Review')
+def review_changed(sender, instance, **kwargs):
+    if listing.refresh_business_ratings(user_id=instance.business_user_id):
+        cache.invalidate_offers([instance.business_user_id])
+
+
+def _get_user_names(user):
+    # None for names not loaded, e.g. deferred ones.
+    return tuple(user.__dict__.get(field) for field in USER_DETAIL_FIELDS)
+
+
+@receiver(post_init, sender=settings.AUTH_USER_MODEL)
+def user_loaded(sender, instance, **kwargs):
+    # The names as stored, to tell renames apart from other saves such as
+    # a new last_login or password. None for new users.
+    instance._stored_names = _get_user_names(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    stored_names, instance._stored_names = instance._stored_names, _get_user_names(instance)
+    if created:
+        return
+    if update_fields is not None and not set(USER_DETAIL_FIELDS).intersection(update_fields):
+        return
+    if (stored_names is not None and None not in stored_names
+            and stored_names == instance._stored_names):
+        return
+
+    # The names are part of the offer and listing fragments, whose cache
+    # keys follow them, see `offers_app.fragments`.
+    if listing.refresh_user_details(instance):
+        cache.invalidate_offers([instance.pk])
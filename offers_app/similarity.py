@@ -0,0 +1,210 @@
+"""
+Precomputed "similar offers".
+
+The similarity of two offers combines the Jaccard similarity of their
+feature sets with the closeness of their minimum prices:
+
+    score = (1 - PRICE_WEIGHT) * jaccard + PRICE_WEIGHT * min(p, q) / max(p, q)
+
+Only offers sharing at least one feature are neighbors. Candidates are
+taken from the inverted feature index of `offers_app.indexes`, so no
+offer is compared with offers it shares nothing with, and are pruned by
+their Jaccard similarity before any price is loaded: the price adds at
+most PRICE_WEIGHT to a score, so candidates too far below the TOP_K-th
+best Jaccard similarity are dropped, and at most MAX_CANDIDATES are kept.
+The TOP_K best neighbors of every offer are stored in the SimilarOffer
+table.
+
+`rebuild_similar_offers` computes the whole table and is run by the
+`rebuild_similar_offers` command. `queue_similar_offers_update` keeps it
+roughly up to date when offers change: it is called by the receivers in
+`offers_app.signals` and runs `update_similar_offers` once the
+transaction commits. The update still runs in the thread of the request
+that made the change, before its response is sent, so it is kept small:
+
+- Only offers whose feature names or minimum price changed are updated.
+  A digest of both is kept in the cache per offer, so e.g. a new title
+  costs one query and one cache lookup.
+- A changed offer is recomputed together with its neighbors before and
+  after the change, i.e. at most 2 * TOP_K + 1 offers, which reads the
+  prices of at most MAX_CANDIDATES neighbors each. Other offers listing
+  it keep their stored score, and offers that would now list it do not,
+  until the next batch rebuild.
+- The neighbors of a deleted offer are taken from the best rows listing
+  it. Any other rows listing it are removed.
+"""
+import hashlib
+import heapq
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+
+from offers_app.indexes import feature_index
+
+TOP_K = 10
+PRICE_WEIGHT = 0.25
+MAX_CANDIDATES = 100
+CHUNK_SIZE = 500
+FINGERPRINT_KEY = 'offers:similarity:fingerprint:{}'
+
+
+def get_chunks(ids, chunk_size=CHUNK_SIZE):
+    ids = sorted(ids)
+    return [ids[start:start + chunk_size] for start in range(0, len(ids), chunk_size)]
+
+
+def get_prices(offer_ids):
+    """
+    Returns the minimum prices of the given offers that still exist.
+    """
+    from offers_app.models import Offer
+
+    prices = {}
+    for chunk in get_chunks(offer_ids):
+        prices.update(Offer.objects.filter(id__in=chunk).values_list('id', 'min_price'))
+    return prices
+
+
+def get_price_closeness(price, other_price):
+    if not price or not other_price:
+        return 0.0
+    return float(min(price, other_price) / max(price, other_price))
+
+
+def get_candidates(similarities):
+    """
+    Returns the neighbors of `similarities`, a dict of Jaccard similarities
+    keyed by offer id, that can still be among the TOP_K best once the
+    price is taken into account. At most MAX_CANDIDATES are kept.
+    """
+    candidates = heapq.nsmallest(
+        MAX_CANDIDATES, similarities.items(), key=lambda item: (-item[1], item[0]))
+    if len(candidates) > TOP_K:
+        # A score is at least (1 - PRICE_WEIGHT) * jaccard and at most
+        # PRICE_WEIGHT more than that.
+        bound = candidates[TOP_K - 1][1] - PRICE_WEIGHT / (1 - PRICE_WEIGHT)
+        candidates = [item for item in candidates if item[1] >= bound]
+    return dict(candidates)
+
+
+def get_scores(offer_ids, prices=None):
+    """
+    Returns the scores of the candidate neighbors of the given offers,
+    keyed by offer id. Offers that no longer exist are left out.
+    """
+    similarities = {offer_id: get_candidates(neighbors) for offer_id, neighbors
+                    in feature_index.jaccard_similarities(offer_ids).items()}
+    if prices is None:
+        prices = get_prices(set(similarities).union(*similarities.values()))
+    return {
+        offer_id: {
+            other_id: ((1 - PRICE_WEIGHT) * jaccard
+                       + PRICE_WEIGHT * get_price_closeness(prices[offer_id], prices[other_id]))
+            for other_id, jaccard in neighbors.items() if other_id in prices
+        }
+        for offer_id, neighbors in similarities.items() if offer_id in prices
+    }
+
+
+def get_top_neighbors(scores):
+    """
+    Returns the TOP_K best (offer id, score) pairs of `scores`.
+    """
+    return heapq.nsmallest(TOP_K, scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def build_rows(neighbors):
+    from offers_app.models import SimilarOffer
+
+    return [SimilarOffer(offer_id=offer_id, similar_id=similar_id, score=score)
+            for offer_id, top in neighbors.items() for similar_id, score in top]
+
+
+def rebuild_similar_offers(chunk_size=CHUNK_SIZE):
+    """
+    Recomputes the neighbors of all offers. Returns the number of rows.
+    """
+    from offers_app.models import Offer, SimilarOffer
+
+    prices = dict(Offer.objects.values_list('id', 'min_price'))
+    offer_ids = sorted(prices)
+    count = 0
+    with transaction.atomic():
+        SimilarOffer.objects.all().delete()
+        for start in range(0, len(offer_ids), chunk_size):
+            scores = get_scores(offer_ids[start:start + chunk_size], prices)
+            rows = SimilarOffer.objects.bulk_create(build_rows(
+                {offer_id: get_top_neighbors(neighbors) for offer_id, neighbors in scores.items()}))
+            count += len(rows)
+    return count
+
+
+def get_fingerprints(offer_ids):
+    """
+    Returns a digest of the feature names and minimum price of each of the
+    given offers that still exist.
+    """
+    features = feature_index.features_of(offer_ids)
+    return {
+        offer_id: hashlib.md5(repr((sorted(features[offer_id]), str(price))).encode(
+            'utf-8')).hexdigest()
+        for offer_id, price in get_prices(offer_ids).items()
+    }
+
+
+def update_similar_offers(offer_ids):
+    """
+    Updates the neighbors of the given offers whose features or minimum
+    price changed, and of their closest neighbors.
+    Returns the number of offers recomputed.
+    """
+    from offers_app.models import SimilarOffer
+
+    offer_ids = set(offer_ids)
+    fingerprints = get_fingerprints(offer_ids)
+    stored = cache.get_many([FINGERPRINT_KEY.format(offer_id) for offer_id in fingerprints])
+    changed = {offer_id for offer_id, fingerprint in fingerprints.items()
+               if stored.get(FINGERPRINT_KEY.format(offer_id)) != fingerprint}
+    deleted = offer_ids - set(fingerprints)
+    if not changed and not deleted:
+        return 0
+
+    recomputed = set(changed)
+    scores = get_scores(changed)
+    for offer_id in changed:
+        recomputed.update(similar_id for similar_id, _ in get_top_neighbors(scores[offer_id]))
+    for chunk in get_chunks(changed):
+        recomputed.update(SimilarOffer.objects.filter(
+            offer_id__in=chunk).values_list('similar_id', flat=True))
+    for offer_id in deleted:
+        recomputed.update(SimilarOffer.objects.filter(similar_id=offer_id).order_by(
+            '-score').values_list('offer_id', flat=True)[:TOP_K])
+    recomputed -= deleted
+    scores.update(get_scores(recomputed - set(scores)))
+
+    for chunk in get_chunks(recomputed | deleted):
+        with transaction.atomic():
+            SimilarOffer.objects.filter(offer_id__in=chunk).delete()
+            SimilarOffer.objects.filter(similar_id__in=[
+                offer_id for offer_id in chunk if offer_id in deleted]).delete()
+            SimilarOffer.objects.bulk_create(build_rows({
+                offer_id: get_top_neighbors(scores[offer_id])
+                for offer_id in chunk if offer_id in scores
+            }), ignore_conflicts=True)
+
+    cache.set_many({FINGERPRINT_KEY.format(offer_id): fingerprints[offer_id]
+                    for offer_id in changed}, timeout=None)
+    cache.delete_many([FINGERPRINT_KEY.format(offer_id) for offer_id in deleted])
+    return len(recomputed)
+
+
+def queue_similar_offers_update(offer_ids):
+    """
+    Updates the similar offers for the given offers once the transaction
+    commits. The update runs in the request thread, but a failing update
+    does not fail the request.
+    """
+    offer_ids = set(offer_ids)
+    if offer_ids:
+        transaction.on_commit(partial(update_similar_offers, offer_ids), robust=True)
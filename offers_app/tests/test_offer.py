@@ -1,9 +1,32 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
-from ..models import Offer, OfferDetail, Feature
+from ..api.pagination import OfferCursorPagination
+from ..api.serializers import OfferSerializer, OfferListingSerializer, parse_feature_name
+from .. import maintenance, similarity
+from ..api.views import OfferImportView
+from ..cache import invalidate_offers
+from ..indexes import FeatureIndex, TitleIndex, feature_index, title_index
+from ..models import Offer, OfferDetail, Feature, OfferListing, SimilarOffer
+from ..signals import offers_changed
+from orders_app.models import Order
+from reviews_app.models import Review
 
 
 class OfferTests(APITestCase):
@@ -269,3 +292,1006 @@ class OfferTests(APITestCase):
         self.assertEqual(Offer.objects.count(), 0, "Offer not deleted")
         self.assertEqual(OfferDetail.objects.count(),
                          0, "OfferDetail not deleted")
+
+
+class OfferQueryTests(APITestCase):
+    LIST_QUERY_BUDGET = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='querybusiness', first_name='Query', last_name='Business', password='testpassword')
+        cls.user.userprofile.type = "business"
+        cls.user.save()
+
+        cls.offer_url = reverse('offers')
+        cls.single_offer_url = lambda pk: reverse(
+            'single_offer', kwargs={'pk': pk})
+
+    def setUp(self):
+        cache.clear()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.user.auth_token.key}')
+
+    def create_offers(self, count, title="Query Offer"):
+        features = [Feature.objects.get_or_create(name=name)[0]
+                    for name in ("Logo Design", "Flyer")]
+        offers = []
+        for index in range(count):
+            offer = Offer.objects.create(
+                user=self.user, title=f"{title} {index}", description="Description",
+                min_price=100 + index, min_delivery_time=5)
+            for offer_type, price in (("basic", 100), ("standard", 200), ("premium", 300)):
+                detail = OfferDetail.objects.create(
+                    offer=offer, title=offer_type, revisions=2, delivery_time_in_days=5,
+                    price=price + index, offer_type=offer_type)
+                detail.features.set(features)
+            offers.append(offer)
+        return offers
+
+    def test_list_query_count_is_independent_of_page_size(self):
+        self.create_offers(3)
+        with self.assertNumQueries(self.LIST_QUERY_BUDGET):
+            response = self.client.get(self.offer_url, {'page_size': 50})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 3)
+
+        self.create_offers(20, title="More Offer")
+        with self.assertNumQueries(self.LIST_QUERY_BUDGET):
+            response = self.client.get(self.offer_url, {'page_size': 50})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 23)
+
+    def test_list_payload_contains_user_and_details(self):
+        offer = self.create_offers(1)[0]
+        response = self.client.get(self.offer_url)
+        result = response.data['results'][0]
+        self.assertEqual(result['user_details'], {
+            "first_name": "Query", "last_name": "Business", "username": "querybusiness"})
+        self.assertEqual([detail['id'] for detail in result['details']],
+                         [detail.id for detail in offer.details.all()])
+
+    def test_single_offer_query_count_is_independent_of_details(self):
+        offer = self.create_offers(1)[0]
+        with self.assertNumQueries(5):
+            response = self.client.get(self.single_offer_url(offer.id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['details']), 3)
+        self.assertEqual(response.data['details'][0]['features'],
+                         ["Logo Design", "Flyer"])
+
+    def collect_cursor_pages(self, params):
+        ids, pages = [], 0
+        response = self.client.get(
+            self.offer_url, {'pagination': 'cursor', **params})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids.extend(result['id'] for result in response.data['results'])
+            pages += 1
+            if not response.data['next']:
+                return ids, pages, response
+            response = self.client.get(response.data['next'])
+
+    def test_cursor_pagination_breaks_ties_on_id(self):
+        prices = [300, 100, 200, 100, 100, None, 200, 50]
+        offers = [Offer.objects.create(user=self.user, title=f"Offer {index}",
+                                       description="Description", min_price=price)
+                  for index, price in enumerate(prices)]
+        expected = [offer.id for offer in sorted(
+            offers, key=lambda offer: (offer.min_price is None, offer.min_price or 0, offer.id))]
+
+        ids, pages, last_response = self.collect_cursor_pages(
+            {'page_size': 3, 'ordering': 'min_price'})
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+        previous_ids = []
+        response = last_response
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'])
+            previous_ids = [result['id']
+                            for result in response.data['results']] + previous_ids
+        self.assertEqual(previous_ids, expected[:6])
+
+        ids, _, _ = self.collect_cursor_pages(
+            {'page_size': 3, 'ordering': '-min_price'})
+        expected_descending = [offer.id for offer in sorted(
+            offers, key=lambda offer: (offer.min_price is None, -(offer.min_price or 0), -offer.id))]
+        self.assertEqual(ids, expected_descending)
+
+    def test_cursor_pagination_by_updated_at(self):
+        offers = self.create_offers(5)
+        ids, _, _ = self.collect_cursor_pages(
+            {'page_size': 2, 'ordering': '-updated_at'})
+        self.assertEqual(ids, [offer.id for offer in reversed(offers)])
+
+    def test_cursor_pagination_keeps_microseconds_of_positions(self):
+        offers = self.create_offers(4)
+        updated_at = OfferListing.objects.get(offer=offers[0]).updated_at.replace(microsecond=0)
+        for index, offer in enumerate(offers):
+            OfferListing.objects.filter(offer=offer).update(
+                updated_at=updated_at.replace(microsecond=100 * (index + 1)))
+        ids, _, _ = self.collect_cursor_pages(
+            {'page_size': 2, 'ordering': '-updated_at'})
+        self.assertEqual(ids, [offer.id for offer in reversed(offers)])
+
+    def test_cursor_pagination_deep_page_costs_the_same_as_first(self):
+        self.create_offers(10)
+        with CaptureQueriesContext(connection) as first_page:
+            response = self.client.get(
+                self.offer_url, {'pagination': 'cursor', 'page_size': 3})
+        next_page = self.client.get(response.data['next'])
+        with CaptureQueriesContext(connection) as deep_page:
+            self.client.get(next_page.data['next'])
+        self.assertEqual(len(first_page), len(deep_page))
+        self.assertFalse(any('COUNT(' in query['sql']
+                             for query in deep_page.captured_queries))
+
+    def test_cursor_pagination_invalid_cursor(self):
+        response = self.client.get(self.offer_url, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def search(self, term, **params):
+        response = self.client.get(
+            self.offer_url, {'search': term, 'page_size': 50, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [result['id'] for result in response.data['results']]
+
+    def test_search_matches_title_description_and_features(self):
+        offer = self.create_offers(1)[0]
+        other = Offer.objects.create(
+            user=self.user, title="Website", description="Responsive layout")
+
+        self.assertEqual(self.search("query"), [offer.id])
+        self.assertEqual(self.search("respons"), [other.id])
+        self.assertEqual(self.search("flyer"), [offer.id])
+        self.assertEqual(self.search("logo flyer"), [offer.id])
+        self.assertEqual(self.search("logo website"), [])
+        self.assertEqual(self.search('"*('), [])
+
+    def test_search_is_ranked_by_relevance(self):
+        in_description = Offer.objects.create(
+            user=self.user, title="Branding", description="We also print a Flyer", min_price=10)
+        in_title = Offer.objects.create(
+            user=self.user, title="Flyer Printing", description="Paper", min_price=20)
+
+        self.assertEqual(self.search("flyer"), [in_title.id, in_description.id])
+        self.assertEqual(self.search("flyer", ordering='min_price'),
+                         [in_description.id, in_title.id])
+
+    def test_search_runs_the_match_once(self):
+        offer = self.create_offers(1)[0]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.search("flyer"), [offer.id])
+        search_queries = [query['sql'] for query in queries.captured_queries
+                          if 'offers_app_offer_search' in query['sql']]
+        self.assertTrue(search_queries)
+        for sql in search_queries:
+            self.assertEqual(sql.count('MATCH'), 1)
+            self.assertNotIn('rowid = ', sql)
+        self.assertEqual(self.search("flyer", pagination='cursor', page_size=1), [offer.id])
+
+    def test_search_falls_back_to_offer_lookups(self):
+        offer = self.create_offers(1)[0]
+        other = Offer.objects.create(
+            user=self.user, title="Website", description="Responsive layout")
+        with patch('offers_app.search.get_backend', return_value=None):
+            self.assertEqual(self.search("flyer"), [offer.id])
+            self.assertEqual(self.search("respons"), [other.id])
+            self.assertEqual(self.search("logo website"), [])
+
+    def test_search_index_follows_writes(self):
+        offer = self.create_offers(1)[0]
+        detail = offer.details.first()
+
+        offer.title = "Renamed"
+        offer.save()
+        self.assertEqual(self.search("renamed"), [offer.id])
+        self.assertEqual(self.search("query"), [])
+
+        detail.features.add(Feature.objects.create(name="Visitenkarte"))
+        self.assertEqual(self.search("visitenkarte"), [offer.id])
+
+        Feature.objects.filter(name="Visitenkarte").get().delete()
+        self.assertEqual(self.search("visitenkarte"), [])
+
+        response = self.client.delete(self.single_offer_url(offer.id))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.search("renamed"), [])
+
+    def test_listing_payload_matches_offer_serializer(self):
+        offer = self.create_offers(1)[0]
+        response = self.client.get(self.offer_url)
+        request = response.wsgi_request
+        expected = OfferSerializer(
+            offer, context={'request': request}).data
+        self.assertEqual(response.json()['results'][0],
+                         json.loads(JSONRenderer().render(expected)))
+
+    def test_listing_follows_offer_and_user_writes(self):
+        offer = self.create_offers(1)[0]
+        response = self.client.patch(self.single_offer_url(offer.id), {
+            "title": "Patched", "details": [{
+                "title": "Only", "revisions": 1, "delivery_time_in_days": 2,
+                "price": 42, "features": ["Flyer"], "offer_type": "basic"}]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        listing = OfferListing.objects.get(offer=offer)
+        self.assertEqual(listing.title, "Patched")
+        self.assertEqual(listing.min_price, 42)
+        self.assertEqual(listing.details, [
+            {"id": detail.id, "url": f"/offerdetails/{detail.id}/"} for detail in offer.details.all()])
+
+        self.user.first_name = "Renamed"
+        self.user.save()
+        listing.refresh_from_db()
+        self.assertEqual(listing.user_details['first_name'], "Renamed")
+
+        self.client.delete(self.single_offer_url(offer.id))
+        self.assertFalse(OfferListing.objects.exists())
+
+    def test_rebuild_offer_listings_command(self):
+        offers = self.create_offers(2)
+        OfferListing.objects.filter(offer=offers[0]).delete()
+        OfferListing.objects.filter(offer=offers[1]).update(title="Stale")
+
+        call_command('rebuild_offer_listings', stdout=StringIO())
+
+        self.assertEqual(
+            sorted(OfferListing.objects.values_list('title', flat=True)),
+            ["Query Offer 0", "Query Offer 1"])
+
+    def test_list_responses_are_cached_per_normalized_query(self):
+        self.create_offers(2)
+        params = {'creator_id': self.user.id, 'search': 'Query', 'ordering': 'min_price'}
+        first = self.client.get(self.offer_url, params)
+
+        with self.assertNumQueries(1):
+            second = self.client.get(
+                self.offer_url, {'ordering': 'min_price ', 'search': '  query', 'creator_id': self.user.id})
+        self.assertEqual(first.json(), second.json())
+
+    def test_list_cache_is_invalidated_by_creator_tag(self):
+        other = User.objects.create_user(username='otherbusiness')
+        other_offer = Offer.objects.create(
+            user=other, title="Other", description="Description")
+        offer = self.create_offers(1)[0]
+
+        self.client.get(self.offer_url, {'creator_id': self.user.id})
+        self.client.get(self.offer_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other_offer.title = "Other renamed"
+            other_offer.save()
+
+        with self.assertNumQueries(1):
+            self.client.get(self.offer_url, {'creator_id': self.user.id})
+        response = self.client.get(self.offer_url)
+        self.assertIn("Other renamed", [
+            result['title'] for result in response.data['results']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(self.single_offer_url(offer.id))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get(
+            self.offer_url, {'creator_id': self.user.id})
+        self.assertEqual(response.data['results'], [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN output is SQLite specific')
+    def test_listing_queries_use_composite_indexes(self):
+        listings = OfferListing.objects.all()
+        self.assertIn('listing_user_price_idx', listings.filter(
+            user_id=self.user.id).order_by('min_price', 'pk').explain())
+        self.assertIn('listing_user_updated_idx', listings.filter(
+            user_id=self.user.id).order_by('-updated_at', '-pk').explain())
+        self.assertIn('listing_price_idx', listings.order_by(
+            'min_price', 'pk').explain())
+        self.assertIn('listing_updated_idx', listings.order_by(
+            'updated_at', 'pk').explain())
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN output is SQLite specific')
+    def test_cursor_pages_seek_the_ordering_index(self):
+        paginator = OfferCursorPagination()
+        listings = OfferListing.objects.all()
+
+        paginator.ordering = ('min_price', 'pk')
+        segment = paginator.get_segments(listings, (100, 5), False)[0]
+        self.assertIn('SEARCH offers_app_offerlisting USING INDEX listing_price_idx (min_price>?)',
+                      segment.explain())
+        segment = paginator.get_segments(listings, (100, 5), True)[0]
+        self.assertIn('USING INDEX listing_price_idx (min_price>? AND min_price<?)',
+                      segment.explain())
+
+        paginator.ordering = ('-updated_at', '-pk')
+        segment = paginator.get_segments(
+            listings.filter(user_id=self.user.id), (timezone.now(), 5), False)[0]
+        self.assertIn('SEARCH offers_app_offerlisting USING INDEX listing_user_updated_idx '
+                      '(user_id=? AND updated_at<?)', segment.explain())
+
+    def offer_payload(self, feature_names):
+        return {
+            "title": "Batched Offer",
+            "description": "Description",
+            "details": [
+                {"title": offer_type, "revisions": 2, "delivery_time_in_days": days,
+                 "price": price, "features": feature_names, "offer_type": offer_type}
+                for offer_type, days, price in (("basic", 7, 100), ("standard", 5, 200), ("premium", 3, 300))
+            ]
+        }
+
+    def test_create_offer_resolves_features_in_constant_queries(self):
+        Feature.objects.create(name="Existing")
+        # Builds the in-process indexes, so both measured requests update them in place.
+        self.client.post(self.offer_url, self.offer_payload(["Existing"]), format='json')
+        with CaptureQueriesContext(connection) as few_features:
+            response = self.client.post(self.offer_url, self.offer_payload(
+                ["Existing", "New 1"]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        with CaptureQueriesContext(connection) as many_features:
+            response = self.client.post(self.offer_url, self.offer_payload(
+                ["Existing"] + [f"Other {index}" for index in range(10)]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(len(few_features), len(many_features))
+
+        offer = Offer.objects.get(pk=response.data['id'])
+        self.assertEqual(offer.min_price, 100)
+        self.assertEqual(offer.min_delivery_time, 3)
+        for detail in offer.details.all():
+            self.assertEqual(sorted(detail.features.values_list('name', flat=True)),
+                             sorted(["Existing"] + [f"Other {index}" for index in range(10)]))
+        self.assertEqual(Feature.objects.count(), 12)
+
+    def details_payload(self, offer, **changes):
+        details = []
+        for detail in offer.details.all():
+            data = {
+                "id": detail.id, "title": detail.title, "revisions": detail.revisions,
+                "delivery_time_in_days": detail.delivery_time_in_days, "price": str(detail.price),
+                "features": list(detail.features.values_list('name', flat=True)),
+                "offer_type": detail.offer_type,
+            }
+            data.update(changes.get(detail.offer_type, {}))
+            details.append(data)
+        return {"details": details}
+
+    def test_update_without_changes_touches_no_rows(self):
+        offer = self.create_offers(1)[0]
+        updated_at = Offer.objects.get(pk=offer.pk).updated_at
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.single_offer_url(offer.id), {
+                "title": offer.title, **self.details_payload(offer)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        writes = [query['sql'] for query in queries.captured_queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(writes, [])
+        self.assertEqual(Offer.objects.get(pk=offer.pk).updated_at, updated_at)
+
+    def test_update_writes_only_changed_details_and_links(self):
+        offer = self.create_offers(1)[0]
+        basic = offer.details.get(offer_type="basic")
+        premium = offer.details.get(offer_type="premium")
+        Through = OfferDetail.features.through
+        kept_links = set(Through.objects.exclude(
+            offerdetail=premium).values_list('id', flat=True))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.single_offer_url(offer.id), self.details_payload(
+                offer,
+                basic={"price": "20.00"},
+                premium={"features": ["Logo Design", "Source Files"]}), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        detail_updates = [query['sql'] for query in queries.captured_queries
+                          if query['sql'].startswith('UPDATE "offers_app_offerdetail"')]
+        self.assertEqual(len(detail_updates), 2)
+        self.assertIn('"price"', detail_updates[0])
+        self.assertTrue(detail_updates[1].startswith(
+            'UPDATE "offers_app_offerdetail" SET "updated_at"'))
+        self.assertIn(f'IN ({premium.id})', detail_updates[1])
+
+        basic.refresh_from_db()
+        offer.refresh_from_db()
+        self.assertEqual(basic.price, 20)
+        self.assertEqual(offer.min_price, 20)
+        self.assertEqual(sorted(premium.features.values_list('name', flat=True)),
+                         ["Logo Design", "Source Files"])
+        self.assertTrue(kept_links <= set(
+            Through.objects.values_list('id', flat=True)))
+
+    def create_offer_with_features(self, user, feature_names):
+        offer = Offer.objects.create(
+            user=user, title="Delete Offer", description="Description",
+            min_price=100, min_delivery_time=5)
+        for offer_type in ("basic", "standard", "premium"):
+            detail = OfferDetail.objects.create(
+                offer=offer, title=offer_type, revisions=2, delivery_time_in_days=5,
+                price=100, offer_type=offer_type)
+            detail.features.set(Feature.objects.resolve(
+                f"{offer_type} {name}" for name in feature_names).values())
+        return offer
+
+    def test_delete_offer_query_count_is_independent_of_features(self):
+        small = self.create_offer_with_features(self.user, ["A"])
+        large = self.create_offer_with_features(
+            self.user, [f"Feature {index}" for index in range(10)])
+
+        with CaptureQueriesContext(connection) as small_queries:
+            small.delete()
+        with CaptureQueriesContext(connection) as large_queries:
+            large.delete()
+        self.assertEqual(len(small_queries), len(large_queries))
+        self.assertEqual(Feature.objects.count(), 0)
+
+    def test_delete_keeps_features_used_elsewhere(self):
+        offer = self.create_offer_with_features(self.user, ["Shared", "Ordered", "Orphan"])
+        other = self.create_offer_with_features(self.user, [])
+        other.details.get(offer_type="basic").features.add(
+            Feature.objects.get(name="basic Shared"))
+        order = Order.objects.create(
+            customer_user=self.user, business_user=self.user, title="Order",
+            delivery_time_in_days=5, price=100, feature_names=["basic Ordered"])
+
+        offer.details.get(offer_type="premium").delete()
+        self.assertFalse(Feature.objects.filter(name__startswith="premium").exists())
+
+        self.client.delete(self.single_offer_url(offer.id))
+        self.assertEqual(sorted(Feature.objects.values_list('name', flat=True)),
+                         ["basic Shared"])
+        # Orders keep a snapshot of the feature names.
+        order.refresh_from_db()
+        self.assertEqual(order.feature_names, ["basic Ordered"])
+
+    def test_user_delete_cascades_to_orphaned_features(self):
+        user = User.objects.create_user(username='leavingbusiness', password='testpassword')
+        offer = self.create_offer_with_features(user, ["Logo", "Flyer"])
+        kept = self.create_offer_with_features(self.user, ["Logo"])
+
+        user.delete()
+        self.assertFalse(Offer.objects.filter(pk=offer.pk).exists())
+        self.assertFalse(OfferDetail.objects.filter(offer_id=offer.pk).exists())
+        self.assertFalse(OfferListing.objects.filter(offer_id=offer.pk).exists())
+        self.assertEqual(Feature.objects.count(), 3)
+        self.assertEqual(kept.details.count(), 3)
+
+    def test_collect_orphaned_features_command(self):
+        offer = self.create_offer_with_features(self.user, ["Linked"])
+        for index in range(5):
+            Feature.objects.create(name=f"Orphan {index}")
+        Feature.objects.filter(name__startswith="Orphan").update(
+            created_at=timezone.now() - timedelta(minutes=10))
+        Feature.objects.create(name="Fresh")
+
+        out = StringIO()
+        call_command('collect_orphaned_features', chunk_size=2, stdout=out)
+        self.assertIn('Reclaimed 5 orphaned features.', out.getvalue())
+        self.assertEqual(Feature.objects.filter(name__startswith="Orphan").count(), 0)
+        # Features created within the grace period may be about to be linked.
+        self.assertTrue(Feature.objects.filter(name="Fresh").exists())
+        call_command('collect_orphaned_features', grace_minutes=0, stdout=out)
+        self.assertFalse(Feature.objects.filter(name="Fresh").exists())
+        self.assertEqual(Feature.objects.filter(
+            offerdetail__offer=offer).distinct().count(), 3)
+
+    def test_collect_orphaned_features_keeps_features_linked_meanwhile(self):
+        offer = self.create_offer_with_features(self.user, ["Linked"])
+        feature = Feature.objects.create(name="Resolved")
+        Feature.objects.filter(pk=feature.pk).update(
+            created_at=timezone.now() - timedelta(minutes=10))
+        select_for_update = QuerySet.select_for_update
+
+        def link_before_lock(queryset, *args, **kwargs):
+            # A concurrent offer create links the feature after the
+            # candidates were read.
+            offer.details.first().features.add(feature)
+            return select_for_update(queryset, *args, **kwargs)
+
+        with patch.object(QuerySet, 'select_for_update', link_before_lock):
+            self.assertEqual(maintenance.collect_orphaned_features(), 0)
+        self.assertTrue(Feature.objects.filter(pk=feature.pk).exists())
+
+    def test_single_offer_is_assembled_from_cached_fragments(self):
+        offer = self.create_offers(1)[0]
+        first = self.client.get(self.single_offer_url(offer.id))
+
+        with self.assertNumQueries(4):
+            second = self.client.get(self.single_offer_url(offer.id))
+        self.assertEqual(second.data, first.data)
+
+        self.client.patch(self.single_offer_url(offer.id), self.details_payload(
+            offer, premium={"features": ["Source Files"]}), format='json')
+        response = self.client.get(self.single_offer_url(offer.id))
+        premium = next(detail for detail in response.data['details']
+                       if detail['offer_type'] == "premium")
+        self.assertEqual(premium['features'], ["Source Files"])
+
+        self.user.first_name = "Renamed"
+        self.user.save()
+        response = self.client.get(self.single_offer_url(offer.id))
+        self.assertEqual(response.data['user_details']['first_name'], "Renamed")
+
+    def test_user_save_without_rename_keeps_offers(self):
+        offer = self.create_offers(1)[0]
+        offer.refresh_from_db()
+        listing = OfferListing.objects.get(offer=offer)
+        etag = self.client.get(self.single_offer_url(offer.id)).headers['ETag']
+
+        user = User.objects.get(pk=self.user.pk)
+        user.last_login = timezone.now()
+        user.set_password('newpassword')
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertFalse(any('offers_app_' in query['sql'] for query in queries.captured_queries))
+
+        user.first_name = "Renamed"
+        user.save()
+        self.assertEqual(Offer.objects.get(pk=offer.pk).updated_at, offer.updated_at)
+        self.assertEqual(OfferListing.objects.get(offer=offer).updated_at, listing.updated_at)
+        response = self.client.get(self.single_offer_url(offer.id), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user_details']['first_name'], "Renamed")
+        response = self.client.get(self.offer_url)
+        self.assertEqual(response.data['results'][0]['user_details']['first_name'], "Renamed")
+
+    def test_list_renders_only_missing_fragments(self):
+        self.create_offers(3)
+        self.client.get(self.offer_url)
+        invalidate_offers([])
+
+        with patch.object(OfferListingSerializer, 'to_representation',
+                          wraps=OfferListingSerializer().to_representation) as render:
+            response = self.client.get(self.offer_url, {'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(render.call_count, 0)
+
+        offer = Offer.objects.get(title="Query Offer 0")
+        offer.title = "Fresh Title"
+        offer.save()
+        with patch.object(OfferListingSerializer, 'to_representation',
+                          wraps=OfferListingSerializer().to_representation) as render:
+            response = self.client.get(self.offer_url)
+        self.assertEqual(render.call_count, 1)
+        self.assertIn("Fresh Title", [result['title'] for result in response.data['results']])
+
+    def test_conditional_get_answers_304_before_loading_the_offer(self):
+        offer = self.create_offers(1)[0]
+        detail = offer.details.get(offer_type="basic")
+        for url, queries in ((self.offer_url, 1), (self.single_offer_url(offer.id), 2),
+                             (reverse('single_offer_details', kwargs={'pk': detail.id}), 2)):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etag = response.headers['ETag']
+
+            with self.assertNumQueries(queries):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        detail_url = reverse('single_offer_details', kwargs={'pk': detail.id})
+        etags = [self.client.get(url).headers['ETag']
+                 for url in (self.offer_url, self.single_offer_url(offer.id), detail_url)]
+        self.client.patch(self.single_offer_url(offer.id), self.details_payload(
+            offer, basic={"price": "20.00"}), format='json')
+        for url, etag in zip((self.offer_url, self.single_offer_url(offer.id), detail_url), etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_conditional_get_of_missing_offer_is_404(self):
+        response = self.client.get(self.single_offer_url(0), HTTP_IF_NONE_MATCH='"x"')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_facets_count_the_filtered_offers(self):
+        self.create_offers(3)
+        other = User.objects.create_user(username='facetbusiness', password='testpassword')
+        offer = Offer.objects.create(
+            user=other, title="Website", description="Description",
+            min_price=600, min_delivery_time=20)
+        detail = OfferDetail.objects.create(
+            offer=offer, title="basic", revisions=1, delivery_time_in_days=20,
+            price=600, offer_type="basic")
+        detail.features.set(Feature.objects.resolve(["Hosting"]).values())
+
+        facets_url = reverse('offer_facets')
+        response = self.client.get(facets_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(response.data['delivery_time'][2],
+                         {'max_delivery_time': 7, 'count': 3})
+        self.assertEqual(response.data['price'][2],
+                         {'min_price': 100, 'max_price': 250, 'count': 3})
+        self.assertEqual(response.data['price'][4],
+                         {'min_price': 500, 'max_price': None, 'count': 1})
+        self.assertEqual(response.data['offer_type'], [
+            {'offer_type': 'basic', 'count': 4},
+            {'offer_type': 'standard', 'count': 3},
+            {'offer_type': 'premium', 'count': 3}])
+        self.assertEqual(response.data['features'], [
+            {'name': 'Flyer', 'count': 3}, {'name': 'Logo Design', 'count': 3},
+            {'name': 'Hosting', 'count': 1}])
+
+        response = self.client.get(facets_url, {'creator_id': other.id})
+        self.assertEqual(response.data['count'], 1)
+        response = self.client.get(facets_url, {'search': 'website'})
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['features'], [{'name': 'Hosting', 'count': 1}])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(facets_url)
+        self.assertEqual(response.data['count'], 4)
+
+    def import_offers(self, lines):
+        response = self.client.generic(
+            'POST', reverse('offer_import'), '\n'.join(lines),
+            content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [json.loads(line) for line in
+                b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_import_offers_reports_results_per_line(self):
+        valid = self.offer_payload(["Logo Design", "Flyer"])
+        lines = [json.dumps({**valid, "title": f"Imported {index}"}) for index in range(5)]
+        lines[1] = '{"title": '
+        lines[3] = json.dumps({"title": "Without details"})
+
+        with patch.object(OfferImportView, 'batch_size', 2):
+            results = self.import_offers(lines)
+
+        self.assertEqual([(result['line'], result['status']) for result in results],
+                         [(2, 'error'), (1, 'created'), (3, 'created'),
+                          (4, 'error'), (5, 'created')])
+        self.assertIn('details', results[3]['errors'])
+        created = Offer.objects.filter(title__startswith="Imported")
+        self.assertEqual(created.count(), 3)
+        self.assertEqual(OfferDetail.objects.filter(offer__in=created).count(), 9)
+        self.assertEqual(OfferListing.objects.filter(offer__in=created).count(), 3)
+        self.assertEqual(Offer.objects.get(title="Imported 4").min_delivery_time, 3)
+        self.assertEqual(len(self.search("imported")), 3)
+
+    def test_import_offers_writes_in_constant_queries_per_batch(self):
+        lines = [json.dumps(self.offer_payload(["Logo Design"]))]
+        with CaptureQueriesContext(connection) as small:
+            self.import_offers(lines)
+        lines = [json.dumps(self.offer_payload([f"Feature {index}"])) for index in range(20)]
+        with CaptureQueriesContext(connection) as large:
+            self.import_offers(lines)
+        self.assertEqual(len(small), len(large))
+
+    def test_import_offers_requires_business_user(self):
+        customer = User.objects.create_user(username='importcustomer', password='testpassword')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + customer.auth_token.key)
+        response = self.client.generic(
+            'POST', reverse('offer_import'), json.dumps(self.offer_payload([])),
+            content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_create_response_is_rendered_without_queries(self):
+        request = Request(APIRequestFactory().post(self.offer_url))
+        serializer = OfferSerializer(data=self.offer_payload(
+            ["Logo Design", " Flyer ", "Logo Design"]), context={'request': request})
+        self.assertTrue(serializer.is_valid())
+        offer = OfferSerializer.bulk_create_offers(self.user, [serializer.validated_data])[0]
+
+        with self.assertNumQueries(0):
+            data = OfferSerializer(offer, context={'request': request}).data
+        self.assertEqual([detail['id'] for detail in data['details']],
+                         list(offer.details.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(data['details'][0]['features'], ["Logo Design", "Flyer"])
+        self.assertEqual(data['min_price'], 100)
+
+    def test_legacy_feature_names_are_parsed_without_eval(self):
+        self.assertEqual(parse_feature_name("{'name': 'Logo'}"), {'name': 'Logo'})
+        self.assertEqual(parse_feature_name("{__import__('os')}"), "{__import__('os')}")
+        self.assertEqual(parse_feature_name("Logo"), "Logo")
+
+    def test_offer_detail_update_maintains_min_values(self):
+        offer = self.create_offers(1)[0]
+        premium = offer.details.get(offer_type="premium")
+        response = self.client.patch(
+            reverse('single_offer_details', kwargs={'pk': premium.id}),
+            {"price": "10.00", "delivery_time_in_days": 1, "features": ["Flyer"]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        offer.refresh_from_db()
+        self.assertEqual((offer.min_price, offer.min_delivery_time), (10, 1))
+        listing = OfferListing.objects.get(offer=offer)
+        self.assertEqual((listing.min_price, listing.min_delivery_time), (10, 1))
+
+    def test_repair_offer_min_values_command(self):
+        drifted, correct = self.create_offers(2)
+        Offer.objects.filter(pk=drifted.pk).update(min_price=999, min_delivery_time=99)
+        OfferListing.objects.filter(pk=drifted.pk).update(min_price=999, min_delivery_time=99)
+        empty = Offer.objects.create(user=self.user, title="Empty", description="Description")
+        correct_updated_at = Offer.objects.get(pk=correct.pk).updated_at
+
+        out = StringIO()
+        # Savepoint, UPDATE offers, UPDATE listings, creator lookup, release.
+        with self.assertNumQueries(5):
+            call_command('repair_offer_min_values', stdout=out)
+        self.assertIn('Repaired the minimum values of 1 offers.', out.getvalue())
+
+        drifted.refresh_from_db()
+        self.assertEqual((drifted.min_price, drifted.min_delivery_time), (100, 5))
+        listing = OfferListing.objects.get(offer=drifted)
+        self.assertEqual((listing.min_price, listing.min_delivery_time), (100, 5))
+        self.assertEqual(listing.updated_at, drifted.updated_at)
+        self.assertEqual(Offer.objects.get(pk=correct.pk).updated_at, correct_updated_at)
+        self.assertIsNone(Offer.objects.get(pk=empty.pk).min_price)
+
+    def test_offer_filters_combine(self):
+        cheap, middle, expensive = self.create_offers(3)
+        OfferDetail.objects.filter(offer=expensive, offer_type="premium").delete()
+        Feature.objects.create(name="Source Files")
+        middle.details.get(offer_type="basic").features.add(
+            Feature.objects.get(name="Source Files"))
+        reviewer = User.objects.create_user(username='filterreviewer', password='testpassword')
+        Review.objects.create(business_user=self.user, reviewer=reviewer, rating=4,
+                              description="Good")
+
+        def filter_ids(**params):
+            response = self.client.get(self.offer_url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [result['id'] for result in response.data['results']]
+
+        self.assertEqual(filter_ids(min_price__gte=101, min_price__lte=102),
+                         [middle.id, expensive.id])
+        self.assertEqual(filter_ids(offer_type="premium"), [cheap.id, middle.id])
+        self.assertEqual(filter_ids(features="Flyer,Source Files"), [middle.id])
+        self.assertEqual(filter_ids(features="Unknown"), [])
+        self.assertEqual(filter_ids(min_rating=4, offer_type="premium", min_price__gte=101),
+                         [middle.id])
+        self.assertEqual(filter_ids(min_rating=4.5), [])
+
+        response = self.client.get(self.offer_url, {'creator_id': 'x', 'offer_type': 'gold'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['creator_id'], ['Muss eine ganze Zahl sein.'])
+        self.assertEqual(response.data['offer_type'], ['Ungültiger Angebotstyp.'])
+
+    def test_business_rating_follows_reviews(self):
+        offer = self.create_offers(1)[0]
+        reviewer = User.objects.create_user(username='ratingreviewer', password='testpassword')
+        self.assertIsNone(OfferListing.objects.get(offer=offer).business_rating)
+
+        first = Review.objects.create(business_user=self.user, reviewer=reviewer,
+                                      rating=5, description="Great")
+        Review.objects.create(business_user=self.user, reviewer=reviewer,
+                              rating=2, description="Meh")
+        self.assertEqual(OfferListing.objects.get(offer=offer).business_rating, 3.5)
+
+        first.delete()
+        self.assertEqual(OfferListing.objects.get(offer=offer).business_rating, 2)
+        new_offer = self.create_offers(1, title="Rated")[0]
+        self.assertEqual(OfferListing.objects.get(offer=new_offer).business_rating, 2)
+
+    def test_offer_filters_use_indexes(self):
+        self.assertIn('offerdetail_type_offer_idx', OfferDetail.objects.filter(
+            offer_type="basic", offer_id=1).values('id').explain())
+        self.assertIn('listing_rating_price_idx', OfferListing.objects.filter(
+            business_rating__gte=4).order_by('business_rating').explain())
+
+    def test_feature_filters_use_feature_index(self):
+        first, second = self.create_offers(2)
+        Feature.objects.create(name="Source Files")
+        second.details.get(offer_type="basic").features.add(
+            Feature.objects.get(name="Source Files"))
+        self.assertEqual(feature_index.offers_with_all(["Flyer", "Source Files"]), {second.id})
+        self.assertEqual(feature_index.offers_with_any(["Source Files", "Unknown"]), {second.id})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.offer_url, {'features': 'Flyer,Source Files'})
+        self.assertEqual([result['id'] for result in response.data['results']], [second.id])
+        self.assertFalse(any('offerdetail_features' in query['sql']
+                             for query in queries.captured_queries))
+
+        response = self.client.get(self.offer_url, {'features_any': 'Source Files,Logo Design'})
+        self.assertEqual([result['id'] for result in response.data['results']],
+                         [first.id, second.id])
+        response = self.client.get(self.offer_url, {'features_any': 'Unknown'})
+        self.assertEqual(response.data['results'], [])
+
+    def test_feature_filters_fall_back_to_feature_links(self):
+        first, second = self.create_offers(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.details.get(offer_type="basic").features.add(
+                Feature.objects.create(name="Source Files"))
+        with patch('offers_app.api.filters.MAX_OFFER_IDS', 1):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.offer_url, {'features': 'Flyer,Logo Design'})
+            self.assertEqual([result['id'] for result in response.data['results']],
+                             [first.id, second.id])
+            self.assertTrue(any('offerdetail_features' in query['sql']
+                                for query in queries.captured_queries))
+            response = self.client.get(self.offer_url, {'features': 'Flyer,Source Files'})
+            self.assertEqual([result['id'] for result in response.data['results']], [second.id])
+            response = self.client.get(self.offer_url, {'features_any': 'Source Files,Flyer'})
+            self.assertEqual([result['id'] for result in response.data['results']],
+                             [first.id, second.id])
+
+    def test_feature_index_follows_feature_changes(self):
+        first, second = self.create_offers(2)
+        self.assertEqual(feature_index.offers_with_all(["Flyer"]), {first.id, second.id})
+        hosting = Feature.objects.create(name="Hosting")
+
+        with patch.object(feature_index, 'load',
+                          wraps=feature_index.load) as load:
+            with self.captureOnCommitCallbacks(execute=True):
+                first.details.get(offer_type="basic").features.set([hosting])
+                # Uncommitted changes do not reach the index.
+                self.assertEqual(feature_index.offers_with_all(["Hosting"]), set())
+            self.assertEqual(feature_index.offers_with_all(["Flyer"]), {first.id, second.id})
+            self.assertEqual(feature_index.offers_with_all(["Hosting"]), {first.id})
+            with self.captureOnCommitCallbacks(execute=True):
+                first.details.exclude(offer_type="basic").delete()
+            self.assertEqual(feature_index.offers_with_all(["Flyer"]), {second.id})
+            with self.captureOnCommitCallbacks(execute=True):
+                hosting.name = "Managed Hosting"
+                hosting.save()
+            self.assertEqual(feature_index.offers_with_all(["Hosting"]), set())
+            self.assertEqual(feature_index.offers_with_any(["Managed Hosting"]), {first.id})
+            with self.captureOnCommitCallbacks(execute=True):
+                second.delete()
+            self.assertEqual(feature_index.offers_with_any(["Flyer", "Logo Design"]), set())
+        for call in load.call_args_list:
+            self.assertIsNotNone(call.args[0])
+
+    def test_feature_index_applies_changes_of_other_processes(self):
+        offer, other = self.create_offers(2)
+        other_process = FeatureIndex()
+        self.assertEqual(other_process.offers_with_all(["Flyer"]), {offer.id, other.id})
+
+        with patch.object(other_process, 'load', wraps=other_process.load) as load:
+            with self.captureOnCommitCallbacks(execute=True):
+                OfferDetail.objects.get(offer=offer, offer_type="basic").features.clear()
+            self.assertEqual(other_process.offers_with_all(["Flyer"]), {offer.id, other.id})
+            with self.captureOnCommitCallbacks(execute=True):
+                OfferDetail.objects.filter(offer=offer).delete()
+            with self.captureOnCommitCallbacks(execute=True):
+                OfferDetail.objects.filter(offer=other).delete()
+            self.assertEqual(other_process.offers_with_all(["Flyer"]), set())
+            load.assert_called_once_with({offer.id, other.id})
+
+            # Changes that are no longer available make the index rebuild.
+            with self.captureOnCommitCallbacks(execute=True):
+                self.create_offers(1)
+            cache.delete(other_process.get_changes_key(other_process.version + 1))
+            self.assertEqual(len(other_process.offers_with_all(["Flyer"])), 1)
+            load.assert_called_with()
+
+    def test_suggest_completes_titles_and_features(self):
+        self.create_offers(2, title="Logo")
+        self.create_offers(1, title="Flyer Print")
+        suggest_url = reverse('offer_suggest')
+
+        response = self.client.get(suggest_url, {'q': 'LO'})
+        self.assertEqual(response.data, {'titles': ["Logo 0", "Logo 1"],
+                                         'features': ["Logo Design"]})
+        with self.assertNumQueries(1):
+            response = self.client.get(suggest_url, {'q': 'fl', 'limit': 1})
+        self.assertEqual(response.data, {'titles': ["Flyer Print 0"], 'features': ["Flyer"]})
+        self.assertEqual(self.client.get(suggest_url, {'q': ' '}).data,
+                         {'titles': [], 'features': []})
+
+        response = self.client.get(suggest_url, {'q': 'lo', 'limit': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['limit'], ['Muss eine ganze Zahl sein.'])
+
+    def test_suggest_index_sorts_entries_once_on_rebuild(self):
+        self.create_offers(3, title="Zebra")
+        self.create_offers(2, title="apple")
+        index = TitleIndex()
+        with patch('offers_app.indexes.insort') as insort:
+            self.assertEqual(index.complete("", limit=10),
+                             ["apple 0", "apple 1", "Zebra 0", "Zebra 1", "Zebra 2"])
+        insort.assert_not_called()
+
+    def test_suggest_index_follows_offer_writes(self):
+        first, second = self.create_offers(2, title="Logo")
+        self.assertEqual(title_index.complete("logo"), ["Logo 0", "Logo 1"])
+
+        with patch.object(title_index, 'load', wraps=title_index.load) as load:
+            Offer.objects.filter(pk=second.pk).update(title="Logo 0")
+            with self.captureOnCommitCallbacks(execute=True):
+                offers_changed([second.pk])
+            self.assertEqual(title_index.complete("logo"), ["Logo 0"])
+            with self.captureOnCommitCallbacks(execute=True):
+                first.title = "Banner"
+                first.save()
+            self.assertEqual(title_index.complete("logo"), ["Logo 0"])
+            self.assertEqual(title_index.complete("b"), ["Banner"])
+            with self.captureOnCommitCallbacks(execute=True):
+                second.delete()
+            self.assertEqual(title_index.complete("logo"), [])
+        for call in load.call_args_list:
+            self.assertIsNotNone(call.args[0])
+
+    def similar_offer_rows(self):
+        return sorted((offer_id, similar_id, round(score, 6)) for offer_id, similar_id, score
+                      in SimilarOffer.objects.values_list('offer_id', 'similar_id', 'score'))
+
+    def test_similar_offers_rank_by_features_and_price(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            offer, close, far = self.create_offers(3)
+            unrelated = self.create_offers(1, title="Unrelated")[0]
+            OfferDetail.objects.filter(offer=unrelated).first().features.set(
+                [Feature.objects.create(name="Hosting")])
+            OfferDetail.objects.filter(offer=unrelated).exclude(
+                features__name="Hosting").delete()
+            Offer.objects.filter(pk=far.pk).update(min_price=400)
+            offers_changed([far.pk])
+
+        response = self.client.get(reverse('similar_offers', kwargs={'pk': offer.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['id'] for result in response.data], [close.id, far.id])
+        self.assertAlmostEqual(response.data[0]['score'], 0.75 + 0.25 * 100 / 101)
+        self.assertAlmostEqual(response.data[1]['score'], 0.75 + 0.25 * 100 / 400)
+        self.assertEqual(response.data[0]['title'], close.title)
+        response = self.client.get(reverse('similar_offers', kwargs={'pk': unrelated.id}))
+        self.assertEqual(response.data, [])
+
+        response = self.client.get(reverse('similar_offers', kwargs={'pk': 0}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_similar_offers_skip_unrelated_changes_and_bound_fan_out(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            offers = self.create_offers(30)
+        offer = offers[0]
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                offer.title = "Renamed"
+                offer.save()
+        self.assertFalse(any('similaroffer' in query['sql']
+                             for query in queries.captured_queries))
+
+        with self.captureOnCommitCallbacks():
+            offer.details.get(offer_type="basic").features.add(
+                Feature.objects.create(name="Hosting"))
+        feature_index.refresh_offers([offer.id])
+        # All 30 offers share features, but only the offer and its
+        # neighbors, the same before and after, are recomputed.
+        self.assertEqual(similarity.update_similar_offers([offer.id]), similarity.TOP_K + 1)
+        self.assertEqual(similarity.update_similar_offers([offer.id]), 0)
+
+    def test_similar_offers_prune_candidates_before_loading_prices(self):
+        with patch('offers_app.similarity.TOP_K', 2):
+            self.assertEqual(similarity.get_candidates({1: 0.5, 2: 1.0, 3: 0.9, 4: 0.6}),
+                             {2: 1.0, 3: 0.9, 4: 0.6})
+        with self.captureOnCommitCallbacks(execute=True):
+            offers = self.create_offers(30)
+        with patch('offers_app.similarity.MAX_CANDIDATES', 5), \
+                patch('offers_app.similarity.get_prices', wraps=similarity.get_prices) as get_prices:
+            scores = similarity.get_scores([offers[0].id])
+        self.assertEqual(len(scores[offers[0].id]), 5)
+        self.assertEqual(len(get_prices.call_args.args[0]), 6)
+
+    def test_similar_offers_are_updated_incrementally(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            offers = self.create_offers(4)
+            source_files = Feature.objects.create(name="Source Files")
+            offers[0].details.get(offer_type="basic").features.add(source_files)
+            offers[1].details.get(offer_type="premium").features.set([source_files])
+            OfferDetail.objects.filter(offer=offers[1]).exclude(offer_type="premium").delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            offers[2].delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            offers[3].details.get(offer_type="basic").features.clear()
+            self.create_offers(1, title="Late")
+
+        incremental = self.similar_offer_rows()
+        self.assertTrue(incremental)
+        out = StringIO()
+        call_command('rebuild_similar_offers', chunk_size=2, stdout=out)
+        self.assertEqual(self.similar_offer_rows(), incremental)
+        self.assertIn(f'Stored {len(incremental)} similar offers.', out.getvalue())
+
+        with patch('offers_app.similarity.TOP_K', 1):
+            call_command('rebuild_similar_offers', stdout=StringIO())
+            Offer.objects.filter(pk=offers[1].pk).update(min_price=offers[0].min_price)
+            with self.captureOnCommitCallbacks(execute=True):
+                offers_changed([offers[1].pk])
+            incremental = self.similar_offer_rows()
+            call_command('rebuild_similar_offers', stdout=StringIO())
+            self.assertEqual(self.similar_offer_rows(), incremental)
@@ -0,0 +1,23 @@
+from django_filters import rest_framework as django_filters
+
+from ..models import Order
+
+DATE_ERROR = 'Muss ein gültiges Datum sein.'
+
+
+class OrderFilter(django_filters.FilterSet):
+    """
+    Filters for the order list. The role of the user is chosen by OrdersView,
+    as it decides which index every part of the list is read from.
+    """
+    status = django_filters.ChoiceFilter(
+        choices=Order.ORDER_STATUSES,
+        error_messages={'invalid_choice': 'Ungültiger Status.'})
+    created_after = django_filters.DateTimeFilter(
+        field_name='created_at', lookup_expr='gte', error_messages={'invalid': DATE_ERROR})
+    created_before = django_filters.DateTimeFilter(
+        field_name='created_at', lookup_expr='lt', error_messages={'invalid': DATE_ERROR})
+
+    class Meta:
+        model = Order
+        fields = []
@@ -0,0 +1,86 @@
+import heapq
+
+from django.db.models import Q
+
+from offers_app.api.pagination import OfferCursorPagination
+
+
+class OrderCursorPagination(OfferCursorPagination):
+    """
+    Keyset pagination for the orders of a user, newest first.
+
+    The orders of a user are those where the user is the business user and
+    those where the user is the customer. Instead of one query with an OR
+    over both roles, every role is read with its own range scan on its
+    (user, created_at, id) index, limited to one page, and the parts are
+    merged in Python. The cursor stores (created_at, id) of the last row
+    like that of the offer list.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-pk')
+
+    def paginate_querysets(self, querysets, request, view=None):
+        """
+        Returns one page of the union of `querysets`, which must not
+        be ordered or sliced yet.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+
+        reverse = bool(self.cursor and self.cursor.reverse)
+        position = None
+        if self.cursor and self.cursor.position is not None:
+            position = self.decode_position(self.cursor.position, querysets[0])
+
+        parts = []
+        for queryset in querysets:
+            queryset = queryset.order_by(*self.get_order_by(reverse))
+            if position is not None:
+                queryset = queryset.filter(self.get_keyset_filter(position, reverse))
+            parts.append(list(queryset[:self.page_size + 1]))
+
+        results = []
+        for order in heapq.merge(*parts, key=lambda order: (order.created_at, order.pk),
+                                 reverse=not reverse):
+            # An order of the user with itself is found in both parts.
+            if results and results[-1].pk == order.pk:
+                continue
+            results.append(order)
+            if len(results) > self.page_size:
+                break
+        self.page = results[:self.page_size]
+        has_following_position = len(results) > len(self.page)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = position is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_order_by(self, reverse):
+        if reverse:
+            return ['created_at', 'pk']
+        return ['-created_at', '-pk']
+
+    def get_keyset_filter(self, position, reverse):
+        """
+        Builds the row-value predicate (created_at, pk) < (value, pk), or >
+        when paging backwards, as created_at <= value AND (created_at < value
+        OR pk < pk), so the created_at bound seeks the (user, created_at, id)
+        index. `created_at` is never NULL.
+        """
+        value, pk = position
+        lookup = 'gt' if reverse else 'lt'
+        return (Q(**{f'created_at__{lookup}e': value})
+                & (Q(**{f'created_at__{lookup}': value}) | Q(**{f'pk__{lookup}': pk})))
@@ -1,3 +1,4 @@
+from django.db import transaction
 from rest_framework import serializers
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import PermissionDenied, NotAuthenticated
@@ -10,6 +11,8 @@ class OrderSerializer(serializers.ModelSerializer):
     """
     Serializer for the Order model.
     """
+    features = serializers.ListField(
+        source='feature_names', child=serializers.CharField(), read_only=True)
 
     class Meta:
         model = Order
@@ -44,9 +47,11 @@ class OrderSerializer(serializers.ModelSerializer):
             raise NotAuthenticated(
                 {'detail': 'Token ist ungültig'})
 
+    @transaction.atomic
     def create(self, validated_data):
         """
-        Create a new order instance.
+        Create a new order instance. The order and its counters, see
+        `orders_app.stats`, are written in one transaction.
         """
         customer_user = self.get_current_user_from_request(self.context)
 
@@ -77,14 +82,16 @@ class OrderSerializer(serializers.ModelSerializer):
             revisions=offer_detail.revisions,
             delivery_time_in_days=offer_detail.delivery_time_in_days,
             price=offer_detail.price,
-            offer_type=offer_detail.offer_type
+            offer_type=offer_detail.offer_type,
+            feature_names=[feature.name for feature in offer_detail.features.all()]
         )
-        order.features.set(offer_detail.features.all())
         return order
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         """
-        Update an existing order instance.
+        Update an existing order instance. A status transition moves the
+        order between the counters of its users in the same transaction.
         """
         current_user = self.get_current_user_from_request(self.context)
 
@@ -96,12 +103,3 @@ class OrderSerializer(serializers.ModelSerializer):
         instance.status = validated_data.get('status', instance.status)
         instance.save()
         return instance
-
-    def to_representation(self, instance):
-        """
-        Customize the representation of the order instance.
-        """
-        representation = super().to_representation(instance)
-        representation['features'] = [
-            feature.name for feature in instance.features.all()]
-        return representation
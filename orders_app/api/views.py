@@ -1,21 +1,67 @@
+import csv
+import io
+import json
+
 from rest_framework import generics, status, permissions
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from django.db.models import Q
 from django.contrib.auth.models import User
+from django.http import StreamingHttpResponse
+from django_filters.rest_framework import DjangoFilterBackend
 
+from .. import stats
 from ..models import Order
+from .filters import OrderFilter
+from .pagination import OrderCursorPagination
 from .serializers import OrderSerializer
 
 
+def get_user_order_counts(pk):
+    """
+    Returns the order counts per status of the user from its counters, all
+    zero for a user without orders, or None if the user does not exist.
+    """
+    counts = stats.get_order_counts(pk)
+    if counts is None:
+        if not User.objects.filter(pk=pk).exists():
+            return None
+        counts = dict.fromkeys(stats.STATUS_FIELDS, 0)
+    return counts
+
+
+def get_role_fields(request):
+    """
+    Returns the order fields of the roles requested with the `role` query
+    parameter, both roles if it is missing.
+    """
+    role = request.query_params.get('role')
+    if not role:
+        return list(stats.ROLE_FIELDS.values())
+    if role not in stats.ROLE_FIELDS:
+        raise ValidationError({'role': ['Ungültige Rolle.']})
+    return [stats.ROLE_FIELDS[role]]
+
+
 class OrdersView(generics.ListCreateAPIView):
     """
     View to list and create orders.
     Only authenticated users can access this view.
+
+    Query Parameters:
+    - role: 'business' or 'customer' to list only the orders of the user in that role
+    - status: Filter by the order status
+    - created_after, created_before: Filter by the creation date
+    - page_size: Number of orders per page, newest first
+
+    The list is paginated with a cursor, see OrderCursorPagination.
     """
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = OrderSerializer
+    pagination_class = OrderCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = OrderFilter
 
     def get_queryset(self):
         """
@@ -27,6 +73,96 @@ class OrdersView(generics.ListCreateAPIView):
             Q(business_user=user) | Q(customer_user=user)
         )
 
+    def get_role_querysets(self):
+        """
+        Return one queryset per requested role of the user, each answered by
+        the (user, created_at, id) index of that role.
+        """
+        return [Order.objects.filter(**{field: self.request.user})
+                for field in get_role_fields(self.request)]
+
+    def list(self, request, *args, **kwargs):
+        querysets = [self.filter_queryset(queryset) for queryset in self.get_role_querysets()]
+        page = self.paginator.paginate_querysets(querysets, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class OrderExportView(generics.GenericAPIView):
+    """
+    View to export all orders of the authenticated user.
+    Only authenticated users can access this view.
+
+    Query Parameters:
+    - export_format: 'csv' (default) or 'ndjson'
+    - role, status, created_after, created_before: As for OrdersView
+
+    The orders are streamed oldest first. They are read in chunks of
+    `chunk_size`, so memory use does not depend on the number of orders.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = OrderFilter
+    chunk_size = 2000
+    fields = ['id', 'customer_user', 'business_user', 'title', 'revisions',
+              'delivery_time_in_days', 'price', 'offer_type', 'status', 'features',
+              'created_at', 'updated_at']
+    content_types = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+    def get_queryset(self):
+        condition = Q()
+        for field in get_role_fields(self.request):
+            condition |= Q(**{field: self.request.user})
+        return Order.objects.filter(condition)
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in self.content_types:
+            raise ValidationError({'export_format': ['Ungültiges Exportformat.']})
+
+        orders = self.filter_queryset(self.get_queryset()).order_by(
+            'created_at', 'id').iterator(chunk_size=self.chunk_size)
+        rows = (self.get_row(order) for order in orders)
+        if export_format == 'csv':
+            content = self.render_csv(rows)
+        else:
+            content = (json.dumps(row) + '\n' for row in rows)
+        response = StreamingHttpResponse(content, content_type=self.content_types[export_format])
+        response['Content-Disposition'] = f'attachment; filename="orders.{export_format}"'
+        return response
+
+    def get_row(self, order):
+        return {
+            'id': order.id,
+            'customer_user': order.customer_user_id,
+            'business_user': order.business_user_id,
+            'title': order.title,
+            'revisions': order.revisions,
+            'delivery_time_in_days': order.delivery_time_in_days,
+            'price': str(order.price),
+            'offer_type': order.offer_type,
+            'status': order.status,
+            'features': list(order.feature_names),
+            'created_at': order.created_at.isoformat(),
+            'updated_at': order.updated_at.isoformat(),
+        }
+
+    def render_csv(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def flush(values):
+            writer.writerow(values)
+            line = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return line
+
+        yield flush(self.fields)
+        for row in rows:
+            row['features'] = ', '.join(row['features'])
+            yield flush([row[field] for field in self.fields])
+
 
 class SingleOrderView(generics.RetrieveUpdateDestroyAPIView):
     """
@@ -73,9 +209,8 @@ class NotCompletedOrderCountView(APIView):
         Return the count of orders with status 'in_progress' for the user identified by `pk`.
         """
 
-        try:
-            user = User.objects.get(pk=pk)
-        except User.DoesNotExist:
+        counts = get_user_order_counts(pk)
+        if counts is None:
             return Response(
                 {"error": "Geschäftsbenutzer nicht gefunden."},
                 status=status.HTTP_404_NOT_FOUND
@@ -87,10 +222,7 @@ class NotCompletedOrderCountView(APIView):
                 status=status.HTTP_401_UNAUTHORIZED
             )
 
-        order_count = Order.objects.filter(
-            Q(status='in_progress'),
-            Q(business_user=user) | Q(customer_user=user)
-        ).count()
+        order_count = counts['in_progress']
 
         return Response({'order_count': order_count}, status=status.HTTP_200_OK)
 
@@ -108,9 +240,8 @@ class CompletedOrderCountView(APIView):
         for the user identified by `pk`.
         """
 
-        try:
-            user = User.objects.get(pk=pk)
-        except User.DoesNotExist:
+        counts = get_user_order_counts(pk)
+        if counts is None:
             return Response(
                 {"error": "Geschäftsbenutzer nicht gefunden."},
                 status=status.HTTP_404_NOT_FOUND
@@ -122,9 +253,53 @@ class CompletedOrderCountView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        completed_order_count = Order.objects.filter(
-            Q(status__in=['completed', 'cancelled']),
-            Q(business_user=user) | Q(customer_user=user)
-        ).count()
+        completed_order_count = counts['completed'] + counts['cancelled']
 
         return Response({'completed_order_count': completed_order_count}, status=status.HTTP_200_OK)
+
+
+class OrderCountsView(APIView):
+    """
+    View to get the order counts of many users at once.
+    Only authenticated users can access this view.
+
+    Query Parameters:
+    - user_ids: Comma separated ids of at most `max_user_ids` users
+
+    Returns the `order_count` and `completed_order_count` of every existing
+    user, keyed by user id.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    max_user_ids = 100
+
+    def get(self, request, format=None):
+        """
+        Return the counts of the users listed in `user_ids`.
+        """
+        try:
+            user_ids = {int(user_id) for user_id in request.query_params.get(
+                'user_ids', '').split(',') if user_id.strip()}
+        except ValueError:
+            return Response(
+                {"user_ids": ["Muss eine Liste ganzer Zahlen sein."]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not user_ids:
+            return Response(
+                {"user_ids": ["Dieses Feld ist erforderlich."]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(user_ids) > self.max_user_ids:
+            return Response(
+                {"user_ids": [f"Höchstens {self.max_user_ids} Benutzer pro Anfrage."]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        counts = stats.get_order_counts_of_users(user_ids)
+        return Response({
+            str(user_id): {
+                'order_count': user_counts['in_progress'],
+                'completed_order_count': user_counts['completed'] + user_counts['cancelled'],
+            }
+            for user_id, user_counts in counts.items()
+        }, status=status.HTTP_200_OK)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from orders_app import stats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the order counters of all users from their orders.'
+
+    def handle(self, *args, **options):
+        count = stats.rebuild_order_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {count} order counters.'))
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.3 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+CHUNK_SIZE = 500
+
+
+def copy_feature_names(apps, schema_editor):
+    """
+    Stores the names of the linked features on every order, in the order
+    the links were created.
+    """
+    Order = apps.get_model('orders_app', 'Order')
+    Through = Order.features.through
+    order_ids = list(Through.objects.values_list(
+        'order_id', flat=True).distinct().order_by('order_id'))
+    for start in range(0, len(order_ids), CHUNK_SIZE):
+        chunk = order_ids[start:start + CHUNK_SIZE]
+        names = {order_id: [] for order_id in chunk}
+        for order_id, name in Through.objects.filter(order_id__in=chunk).order_by(
+                'id').values_list('order_id', 'feature__name'):
+            names[order_id].append(name)
+        Order.objects.bulk_update(
+            [Order(id=order_id, feature_names=feature_names)
+             for order_id, feature_names in names.items()],
+            ['feature_names'])
+
+
+def link_features(apps, schema_editor):
+    """
+    Links every order to the features named on it again, creating features
+    that no longer exist.
+    """
+    Order = apps.get_model('orders_app', 'Order')
+    Feature = apps.get_model('offers_app', 'Feature')
+    Through = Order.features.through
+    for order in Order.objects.exclude(feature_names=[]).only('id', 'feature_names').iterator(
+            chunk_size=CHUNK_SIZE):
+        Through.objects.bulk_create([
+            Through(order_id=order.id, feature_id=Feature.objects.get_or_create(name=name)[0].id)
+            for name in dict.fromkeys(order.feature_names)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers_app', '0022_similaroffer'),
+        ('orders_app', '0005_order_created_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='feature_names',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(copy_feature_names, link_features),
+        migrations.RemoveField(
+            model_name='order',
+            name='features',
+        ),
+    ]
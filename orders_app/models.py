@@ -1,7 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 
-from offers_app.models import Feature, OfferDetail
+from offers_app.models import OfferDetail
 from django.core.validators import MinValueValidator
 
 
@@ -16,7 +16,7 @@ class Order(models.Model):
         revisions (PositiveIntegerField): Number of revisions allowed for the order.
         delivery_time_in_days (PositiveIntegerField): Delivery time for the order in days.
         price (DecimalField): Price of the order.
-        features (ManyToManyField): Features included in the order.
+        feature_names (JSONField): Names of the features included in the order, copied from the offer detail when the order is placed.
         offer_type (CharField): Type of offer associated with the order.
         status (CharField): Current status of the order.
         created_at (DateTimeField): Timestamp when the order was created.
@@ -43,7 +43,7 @@ class Order(models.Model):
     )
     delivery_time_in_days = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
-    features = models.ManyToManyField(Feature)
+    feature_names = models.JSONField(default=list, blank=True)
     offer_type = models.CharField(
         max_length=20, choices=OfferDetail.OFFER_TYPES, default="basic")
     status = models.CharField(
@@ -51,5 +51,51 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['business_user', 'status'],
+                         name='order_business_status_idx'),
+            models.Index(fields=['customer_user', 'status'],
+                         name='order_customer_status_idx'),
+            models.Index(fields=['business_user', 'created_at', 'id'],
+                         name='order_business_created_idx'),
+            models.Index(fields=['customer_user', 'created_at', 'id'],
+                         name='order_customer_created_idx'),
+        ]
+
     def __str__(self):
         return self.title
+
+
+class UserOrderStats(models.Model):
+    """
+    Number of orders of a user per status, in one of the two roles of an order.
+    Attributes:
+        ROLES (list): The roles a user can have in an order.
+        user (ForeignKey): The user the counts belong to.
+        role (CharField): Whether the counts are of orders as business user or as customer.
+        in_progress, completed, cancelled (PositiveIntegerField): The number of orders per status.
+    The rows are kept up to date by the receivers in `orders_app.signals` and
+    can be recomputed with the `rebuild_order_stats` command, see `orders_app.stats`.
+    """
+
+    ROLES = [
+        ("business", "Business"),
+        ("customer", "Customer"),
+    ]
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='order_stats')
+    role = models.CharField(max_length=20, choices=ROLES)
+    in_progress = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    cancelled = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'role'],
+                                    name='unique_user_order_stats'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} ({self.role})"
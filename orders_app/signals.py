@@ -0,0 +1,27 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from orders_app import stats
+
+
+@receiver(post_init, sender='orders_app.Order')
+def order_loaded(sender, instance, **kwargs):
+    # The status as stored, to tell status transitions apart on save. It is
+    # None for new orders and orders loaded without their status.
+    instance._stored_status = instance.__dict__.get('status') if instance.pk else None
+
+
+@receiver(post_save, sender='orders_app.Order')
+def order_saved(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'status' not in update_fields:
+        return
+    if created:
+        stats.update_order_stats(instance, None, instance.status)
+    elif instance._stored_status is not None:
+        stats.update_order_stats(instance, instance._stored_status, instance.status)
+    instance._stored_status = instance.status
+
+
+@receiver(post_delete, sender='orders_app.Order')
+def order_deleted(sender, instance, **kwargs):
+    stats.update_order_stats(instance, instance._stored_status or instance.status, None)
@@ -0,0 +1,118 @@
+"""
+Maintenance of the `UserOrderStats` counters.
+
+Every order counts once for its business user in the business role and
+once for its customer in the customer role, under its current status.
+The receivers in `orders_app.signals` move an order between the counters
+when it is created, changes its status or is deleted. Writes that bypass
+the signals, e.g. `QuerySet.update`, are reconciled by
+`rebuild_order_stats`.
+
+The counts of many users are read at once with `get_order_counts_of_users`,
+whose results are cached per set of users for a short time.
+"""
+import hashlib
+
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Greatest
+
+ROLE_FIELDS = {'business': 'business_user', 'customer': 'customer_user'}
+STATUS_FIELDS = ['in_progress', 'completed', 'cancelled']
+USER_COUNTS_CACHE_KEY = 'orders:counts:{digest}'
+
+
+def update_order_stats(order, old_status=None, new_status=None):
+    """
+    Moves `order` from the counters of `old_status` to those of
+    `new_status`. Either may be None for a created or deleted order.
+    """
+    if old_status == new_status:
+        return
+    UserOrderStats = global_apps.get_model('orders_app', 'UserOrderStats')
+
+    changes = {}
+    if old_status is not None:
+        # Counters that drifted to zero are not decremented any further.
+        changes[old_status] = Greatest(F(old_status) - 1, Value(0))
+    if new_status is not None:
+        changes[new_status] = F(new_status) + 1
+    user_ids = {role: getattr(order, f'{field}_id') for role, field in ROLE_FIELDS.items()}
+
+    with transaction.atomic():
+        if new_status is not None:
+            UserOrderStats.objects.bulk_create(
+                [UserOrderStats(user_id=user_id, role=role) for role, user_id in user_ids.items()],
+                ignore_conflicts=True)
+        condition = Q()
+        for role, user_id in user_ids.items():
+            condition |= Q(user_id=user_id, role=role)
+        UserOrderStats.objects.filter(condition).update(**changes)
+
+
+def get_order_counts(user_id):
+    """
+    Returns the number of orders per status of the user summed over both
+    roles, or None if the user has no counters.
+    """
+    UserOrderStats = global_apps.get_model('orders_app', 'UserOrderStats')
+    rows = list(UserOrderStats.objects.filter(user_id=user_id).values(*STATUS_FIELDS))
+    if not rows:
+        return None
+    return {status: sum(row[status] for row in rows) for status in STATUS_FIELDS}
+
+
+def get_cache_timeout():
+    return getattr(settings, 'ORDER_COUNTS_CACHE_TIMEOUT', 30)
+
+
+def get_order_counts_of_users(user_ids):
+    """
+    Returns the order counts per status of the given users summed over both
+    roles, keyed by user id. Users that do not exist are left out. The
+    counts are read with one query grouped by user and cached per set of
+    users.
+    """
+    user_ids = sorted(set(user_ids))
+    digest = hashlib.md5(','.join(map(str, user_ids)).encode()).hexdigest()
+    cache_key = USER_COUNTS_CACHE_KEY.format(digest=digest)
+    counts = cache.get(cache_key)
+    if counts is not None:
+        return counts
+
+    User = global_apps.get_model(settings.AUTH_USER_MODEL)
+    UserOrderStats = global_apps.get_model('orders_app', 'UserOrderStats')
+    counts = {user_id: dict.fromkeys(STATUS_FIELDS, 0) for user_id in User.objects.filter(
+        id__in=user_ids).values_list('id', flat=True)}
+    for row in UserOrderStats.objects.filter(user_id__in=user_ids).values('user_id').annotate(
+            **{f'total_{status}': Sum(status) for status in STATUS_FIELDS}).order_by():
+        if row['user_id'] in counts:
+            counts[row['user_id']] = {status: row[f'total_{status}'] for status in STATUS_FIELDS}
+    cache.set(cache_key, counts, get_cache_timeout())
+    return counts
+
+
+def rebuild_order_stats(apps=global_apps):
+    """
+    Recomputes all counters from the orders with one grouped query per
+    role. Returns the number of counter rows.
+    """
+    Order = apps.get_model('orders_app', 'Order')
+    UserOrderStats = apps.get_model('orders_app', 'UserOrderStats')
+
+    counts = {}
+    for role, field in ROLE_FIELDS.items():
+        for user_id, status, count in Order.objects.values(field, 'status').annotate(
+                count=Count('pk')).values_list(field, 'status', 'count').order_by():
+            counts.setdefault((user_id, role), dict.fromkeys(STATUS_FIELDS, 0))[status] = count
+
+    with transaction.atomic():
+        UserOrderStats.objects.all().delete()
+        UserOrderStats.objects.bulk_create([
+            UserOrderStats(user_id=user_id, role=role, **status_counts)
+            for (user_id, role), status_counts in counts.items()
+        ])
+    return len(counts)
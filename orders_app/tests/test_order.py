@@ -1,10 +1,26 @@
+import csv
+import json
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Q
+from django.test import TestCase
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 from offers_app.models import Offer, OfferDetail, Feature
-from ..models import Order
+from ..api.pagination import OrderCursorPagination
+from ..api.views import OrderExportView
+from ..models import Order, UserOrderStats
 
 
 class OrderTests(APITestCase):
@@ -68,7 +84,7 @@ class OrderTests(APITestCase):
             revisions=2, delivery_time_in_days=5, price=100, offer_type="basic")
         response = self.client.get(self.order_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_get_orders_with_invalid_token(self):
         Order.objects.create(
@@ -150,3 +166,265 @@ class OrderTests(APITestCase):
         response = self.client.get(
             self.completed_order_count_url(100))
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN output is SQLite specific')
+class OrderIndexTests(TestCase):
+    def test_role_and_status_filters_use_composite_indexes(self):
+        plan = Order.objects.filter(
+            Q(business_user_id=1) | Q(customer_user_id=1), status='in_progress').explain()
+        self.assertIn('order_business_status_idx', plan)
+        self.assertIn('order_customer_status_idx', plan)
+
+    def test_order_pages_use_created_indexes(self):
+        for field, index in (('business_user_id', 'order_business_created_idx'),
+                             ('customer_user_id', 'order_customer_created_idx')):
+            plan = Order.objects.filter(**{field: 1}).order_by('-created_at', '-pk')[:21].explain()
+            self.assertIn(index, plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+    def test_order_cursor_pages_seek_created_indexes(self):
+        paginator = OrderCursorPagination()
+        for reverse, comparison in ((False, '<'), (True, '>')):
+            keyset = paginator.get_keyset_filter((timezone.now(), 5), reverse)
+            plan = Order.objects.filter(keyset, business_user_id=1).order_by(
+                *paginator.get_order_by(reverse))[:21].explain()
+            self.assertIn('SEARCH orders_app_order USING INDEX order_business_created_idx '
+                          f'(business_user_id=? AND created_at{comparison}?)', plan)
+
+class OrderStatsTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(
+            username='statscustomer', password='testpassword')
+        cls.business_user = User.objects.create_user(
+            username='statsbusiness', password='testpassword')
+        cls.business_user.userprofile.type = 'business'
+        cls.business_user.userprofile.save()
+        offer = Offer.objects.create(
+            user=cls.business_user, title="Stats Offer", description="Description")
+        cls.offer_detail = OfferDetail.objects.create(
+            offer=offer, title="Basic Package", revisions=2, delivery_time_in_days=5,
+            price=100, offer_type="basic")
+
+    def setUp(self):
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.customer.auth_token.key)
+
+    def create_order(self, **kwargs):
+        return Order.objects.create(
+            customer_user=self.customer, business_user=self.business_user, title="Basic Package",
+            revisions=2, delivery_time_in_days=5, price=100, offer_type="basic", **kwargs)
+
+    def get_stats(self):
+        return {(row.user_id, row.role): (row.in_progress, row.completed, row.cancelled)
+                for row in UserOrderStats.objects.all()}
+
+    def test_counters_follow_order_changes(self):
+        response = self.client.post(
+            reverse('orders'), {"offer_detail_id": self.offer_detail.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.create_order(status="cancelled")
+        self.assertEqual(self.get_stats(), {
+            (self.business_user.id, 'business'): (1, 0, 1),
+            (self.customer.id, 'customer'): (1, 0, 1),
+        })
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.business_user.auth_token.key)
+        url = reverse('single_order', kwargs={'pk': response.data['id']})
+        self.client.patch(url, {"status": "completed"}, format='json')
+        self.client.patch(url, {"status": "completed"}, format='json')
+        self.assertEqual(self.get_stats()[(self.business_user.id, 'business')], (0, 1, 1))
+
+        Order.objects.get(pk=response.data['id']).delete()
+        self.assertEqual(self.get_stats(), {
+            (self.business_user.id, 'business'): (0, 0, 1),
+            (self.customer.id, 'customer'): (0, 0, 1),
+        })
+
+    def test_count_views_read_the_counters(self):
+        self.create_order()
+        self.create_order(status="completed")
+        self.create_order(status="cancelled")
+        for user in (self.customer, self.business_user):
+            with self.assertNumQueries(2):
+                response = self.client.get(
+                    reverse('not_completed_order', kwargs={'pk': user.id}))
+            self.assertEqual(response.data['order_count'], 1)
+            response = self.client.get(reverse('completed_order', kwargs={'pk': user.id}))
+            self.assertEqual(response.data['completed_order_count'], 2)
+
+        other = User.objects.create_user(username='statsother', password='testpassword')
+        response = self.client.get(reverse('not_completed_order', kwargs={'pk': other.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['order_count'], 0)
+
+    def test_rebuild_command_reconciles_drift(self):
+        self.create_order()
+        self.create_order()
+        Order.objects.update(status="completed")
+        UserOrderStats.objects.filter(role='customer').delete()
+
+        out = StringIO()
+        call_command('rebuild_order_stats', stdout=out)
+        self.assertIn('Rebuilt 2 order counters.', out.getvalue())
+        self.assertEqual(self.get_stats(), {
+            (self.business_user.id, 'business'): (0, 2, 0),
+            (self.customer.id, 'customer'): (0, 2, 0),
+        })
+
+    def test_batch_counts_are_grouped_and_cached(self):
+        cache.clear()
+        self.create_order()
+        self.create_order(status="completed")
+        other = User.objects.create_user(username='statsother', password='testpassword')
+        url = reverse('order_counts')
+        user_ids = f'{self.business_user.id},{self.customer.id},{other.id},0'
+
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {'user_ids': user_ids})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = {'order_count': 1, 'completed_order_count': 1}
+        self.assertEqual(response.data, {
+            str(self.business_user.id): expected,
+            str(self.customer.id): expected,
+            str(other.id): {'order_count': 0, 'completed_order_count': 0},
+        })
+        with self.assertNumQueries(1):
+            cached = self.client.get(url, {'user_ids': f'0,{other.id},{self.customer.id},'
+                                                       f'{self.business_user.id}'})
+        self.assertEqual(cached.data, response.data)
+
+        for user_ids in ('', '1,x', ','.join(map(str, range(1, 102)))):
+            response = self.client.get(url, {'user_ids': user_ids})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class OrderListTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='listuser', password='testpassword')
+        cls.customer = User.objects.create_user(
+            username='listcustomer', password='testpassword')
+        cls.business_user = User.objects.create_user(
+            username='listbusiness', password='testpassword')
+        cls.orders = []
+        for index in range(7):
+            # The user alternates between the business and the customer role.
+            if index % 2:
+                users = {'business_user': cls.business_user, 'customer_user': cls.user}
+            else:
+                users = {'business_user': cls.user, 'customer_user': cls.customer}
+            order = Order.objects.create(
+                title=f"Order {index}", revisions=2, delivery_time_in_days=5, price=100,
+                offer_type="basic", status="completed" if index < 3 else "in_progress",
+                feature_names=["List Feature"], **users)
+            cls.orders.append(order)
+        Order.objects.create(
+            customer_user=cls.customer, business_user=cls.business_user, title="Other",
+            revisions=2, delivery_time_in_days=5, price=100, offer_type="basic")
+
+    def setUp(self):
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.user.auth_token.key)
+
+    def list_ids(self, **params):
+        response = self.client.get(reverse('orders'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [order['id'] for order in response.data['results']], response.data
+
+    def test_pages_merge_both_roles_newest_first(self):
+        expected = [order.id for order in reversed(self.orders)]
+        ids, data = self.list_ids(page_size=3)
+        pages = [ids]
+        while data['next']:
+            with self.assertNumQueries(3):
+                response = self.client.get(data['next'])
+            data = response.data
+            pages.append([order['id'] for order in data['results']])
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual(data['results'][0]['features'], ["List Feature"])
+
+        response = self.client.get(data['previous'])
+        self.assertEqual([order['id'] for order in response.data['results']], pages[1])
+
+    def test_filters_by_role_status_and_date(self):
+        ids, _ = self.list_ids(role='business')
+        self.assertEqual(ids, [order.id for order in reversed(self.orders[::2])])
+        ids, _ = self.list_ids(role='customer', status='completed')
+        self.assertEqual(ids, [self.orders[1].id])
+
+        Order.objects.filter(pk=self.orders[0].pk).update(created_at='2020-01-01T00:00:00Z')
+        ids, _ = self.list_ids(created_before='2021-01-01')
+        self.assertEqual(ids, [self.orders[0].id])
+        ids, _ = self.list_ids(created_after='2021-01-01')
+        self.assertEqual(len(ids), 6)
+
+        response = self.client.get(reverse('orders'), {'role': 'admin'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['role'], ['Ungültige Rolle.'])
+        response = self.client.get(reverse('orders'), {'created_after': 'x', 'status': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['created_after'], ['Muss ein gültiges Datum sein.'])
+        self.assertEqual(response.data['status'], ['Ungültiger Status.'])
+
+    def test_create_order_stores_feature_snapshot(self):
+        self.customer.userprofile.type = 'customer'
+        self.customer.userprofile.save()
+        feature = Feature.objects.create(name="Snapshot Feature")
+        offer = Offer.objects.create(
+            user=self.business_user, title="Snapshot Offer", description="Description")
+        offer_detail = OfferDetail.objects.create(
+            offer=offer, title="Basic Package", revisions=2, delivery_time_in_days=5,
+            price=100, offer_type="basic")
+        offer_detail.features.add(feature)
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.customer.auth_token.key)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('orders'), {"offer_detail_id": offer_detail.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['features'], ["Snapshot Feature"])
+        inserts = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('INSERT INTO "orders_app_order')]
+        self.assertEqual(len(inserts), 1)
+
+        feature.delete()
+        response = self.client.get(
+            reverse('single_order', kwargs={'pk': response.data['id']}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['features'], ["Snapshot Feature"])
+
+    def export(self, **params):
+        response = self.client.get(reverse('order_export'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_export_streams_csv_and_ndjson(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual([int(row['id']) for row in rows], [order.id for order in self.orders])
+        self.assertEqual(rows[0]['features'], "List Feature")
+        self.assertEqual(rows[0]['price'], "100.00")
+
+        response, content = self.export(export_format='ndjson', role='customer')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row['id'] for row in rows], [order.id for order in self.orders[1::2]])
+        self.assertEqual(rows[0]['features'], ["List Feature"])
+
+        response = self.client.get(reverse('order_export'), {'export_format': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_reads_orders_in_chunks(self):
+        with patch.object(OrderExportView, 'chunk_size', 2):
+            # The orders are fetched in chunks from one cursor.
+            with self.assertNumQueries(2):
+                _, content = self.export(export_format='ndjson')
+        self.assertEqual(len(content.splitlines()), 7)
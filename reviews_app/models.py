@@ -26,3 +26,11 @@ class Review(models.Model):
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['business_user', 'updated_at'],
+                         name='review_business_updated_idx'),
+            models.Index(fields=['reviewer', 'updated_at'],
+                         name='review_reviewer_updated_idx'),
+        ]
@@ -1,3 +1,7 @@
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -168,3 +172,12 @@ class ReviewTests(APITestCase):
             HTTP_AUTHORIZATION='Token ' + self.token.key + 'invalid')
         response = self.client.delete(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN output is SQLite specific')
+class ReviewIndexTests(TestCase):
+    def test_user_filters_ordered_by_update_use_composite_indexes(self):
+        self.assertIn('review_business_updated_idx', Review.objects.filter(
+            business_user_id=1).order_by('-updated_at').explain())
+        self.assertIn('review_reviewer_updated_idx', Review.objects.filter(
+            reviewer_id=1).order_by('-updated_at').explain())
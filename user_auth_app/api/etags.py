@@ -0,0 +1,38 @@
+"""
+ETag functions for conditional GET requests on user profiles.
+
+Saving a user also saves their profile (see `user_auth_app.signals`), so
+the profile's `updated_at` covers the user fields of the payload as well.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+
+from user_auth_app.models import UserProfile
+
+
+def make_etag(*parts):
+    """
+    Hashes the given version parts into an ETag value. Shared by the
+    conditional GET views of all apps.
+    """
+    return hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+
+def profile_etag(request, uid=None, *args, **kwargs):
+    """
+    Uses the profile's `updated_at` for a single profile and the latest
+    `updated_at` plus the number of profiles for the list.
+    """
+    if uid is None:
+        versions = UserProfile.objects.aggregate(
+            updated_at=Max('updated_at'), count=Count('id'))
+        return make_etag('profiles', versions['updated_at'], versions['count'])
+
+    if not str(uid).isdigit():
+        return None
+    updated_at = UserProfile.objects.filter(
+        user_id=uid).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None
+    return make_etag('profile', int(uid), updated_at)
@@ -6,7 +6,10 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 
+from user_auth_app.api.etags import profile_etag
 from user_auth_app.api.serializers import UserProfileSerializer, UserProfileTypeSerializer
 from user_auth_app.models import UserProfile
 
@@ -41,6 +44,7 @@ class UserProfileType_View(APIView):
             return Response({'detail': 'Typ ist erforderlich.'}, status=status.HTTP_400_BAD_REQUEST)
 
 
+@method_decorator(condition(etag_func=profile_etag), name='get')
 class UserProfile_View(APIView):
     """
     API view to retrieve, update, or delete user profiles.
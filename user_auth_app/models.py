@@ -13,6 +13,7 @@ class UserProfile(models.Model):
         description (TextField): A description of the user.
         working_hours (CharField): The working hours of the user.
         type (CharField): The type of user (customer or business).
+        updated_at (DateTimeField): The date and time when the profile or its user was last saved.
     """
     USER_TYPE_CHOICES = [
         ('customer', 'Customer'),
@@ -30,6 +31,7 @@ class UserProfile(models.Model):
         max_length=100, blank=True, null=True, default='9:00 - 18:00')
     type = models.CharField(
         max_length=20, choices=USER_TYPE_CHOICES, default='customer')
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f'(Id: {self.id}) - {self.user.username}'
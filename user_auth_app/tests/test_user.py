@@ -126,3 +126,33 @@ class UserTests(APITestCase):
         response = self.client.post(reverse('logout'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(Token.objects.count(), 0)
+
+
+class UserProfileConditionalTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='etaguser', password='testpassword')
+        cls.profile_url = reverse(
+            'profile_detail', kwargs={'uid': cls.user.id})
+
+    def setUp(self):
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.user.auth_token.key)
+
+    def test_unchanged_profile_is_not_modified(self):
+        for url in (self.profile_url, reverse('profile')):
+            etag = self.client.get(url).headers['ETag']
+            with self.assertNumQueries(2):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code,
+                             status.HTTP_304_NOT_MODIFIED)
+
+    def test_user_change_changes_etag(self):
+        etag = self.client.get(self.profile_url).headers['ETag']
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        response = self.client.get(
+            self.profile_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['first_name'], 'Renamed')